@@ -0,0 +1,34 @@
+"""
+Full author lists of large-collaboration papers.
+
+Particle physics and genomics papers can have thousands of authors. For
+those, processed info only keeps the first few (see query.set_authors),
+and the full list of raw names goes here, one small JSON file per paper,
+to be read (and normalized) only when it is actually asked for.
+"""
+import os
+import json
+
+from routing import CACHE_DIR
+
+
+AUTHORS_DIR = f"{CACHE_DIR}/authors"
+
+_file = lambda key: f"{AUTHORS_DIR}/{key.replace('/', '_')}.json"
+
+
+def store(key, names):
+    """ write the full list of raw author names for paper key """
+    os.makedirs(AUTHORS_DIR, exist_ok=True)
+    tmp = f"{_file(key)}.tmp"
+    with open(tmp, 'w') as file:
+        json.dump(names, file, ensure_ascii=False)
+    os.replace(tmp, _file(key))
+
+
+def load(key):
+    """ full list of raw author names for paper key, None if not stored """
+    if not os.path.exists(_file(key)):
+        return None
+    with open(_file(key)) as file:
+        return json.load(file)
@@ -0,0 +1,268 @@
+"""
+Cache of query results, persistent across runs and shared between processes.
+
+Processed paper info and citation counts are kept in a small sqlite
+database, keyed by normalized ref id, with an in-memory LRU in front of it:
+
+    records.sqlite
+      records(kind, key, value, fetched)    value is JSON; kind is
+                                            'info', 'count' or 'search'
+      responses(url, body, etag, last_modified, fetched)
+                                            raw API responses that came
+                                            with validators
+
+A record older than TTL[kind] is stale: cached lookups (the lookup
+service, `dochub.py --cached`) still return it at once, up to STALE[kind]
+old, while a background refresh replaces it (see service.Resolver);
+prefetch refetches it. Refetches, and all API
+requests, are made conditional on the validators of the stored response
+(ETag / Last-Modified) where the server gave any, so an unchanged record
+costs a 304 and no body. Responses are only stored while the record
+cache is in use (KEEP_RESPONSES, set by service.Resolver), and only
+bodies up to RESPONSE_SIZE; they are pruned to the RESPONSES_MAX most
+recent, none older than RESPONSES_AGE.
+
+Concurrent lookups of the same key are coalesced (see Coalescer): the
+first caller fetches upstream, and everyone else waiting on that key gets
+its result, so overlapping jobs cost one upstream request per paper.
+
+Offline mode (OFFLINE, or $DOCHUB_OFFLINE=1): no network request is made;
+requests fail at once with CacheMiss, and lookups are served from local
+data only, however old (see `dochub.py prefetch` to fill it beforehand).
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+import metrics
+from routing import CACHE_DIR
+from timing import DeadlineExceeded
+
+
+#-----------------------------------------------------------------------------#
+#                                  Constants                                  #
+#-----------------------------------------------------------------------------#
+RECORDS_FILE = f"{CACHE_DIR}/records.sqlite"
+LRU_SIZE = 4096             # records held in memory
+TTL = {'info':   7 * 24 * 3600,  # seconds before a record is stale
+       'count':  1 * 24 * 3600,
+       'search': 1 * 24 * 3600}  # (pages of arXiv search results)
+STALE = {'info': 180 * 24 * 3600, # seconds a stale record is still served
+         'count': 30 * 24 * 3600} # (while refreshed in the background)
+
+RESPONSE_SIZE = 256 << 10    # bytes; larger response bodies are not kept
+RESPONSES_MAX = 20000        # raw responses kept ...
+RESPONSES_AGE = STALE['info'] # ... for at most this many seconds
+PRUNE_EVERY   = 256           # responses stored between prunings
+
+OFFLINE = os.environ.get('DOCHUB_OFFLINE', '') not in ('', '0')
+KEEP_RESPONSES = False  # store API responses for conditional requests
+
+
+class CacheMiss(LookupError):
+    """ offline, and what was asked for is not available locally """
+
+def check_online(url):
+    """ raise CacheMiss if offline, rather than request url """
+    if OFFLINE:
+        raise CacheMiss(f"offline; not requesting {url}")
+
+
+def validators_of(headers):
+    """ the validators (ETag, Last-Modified) in response headers """
+    return {k: headers[k] for k in ('ETag', 'Last-Modified') if headers.get(k)}
+
+def conditional_headers(validators):
+    """ request headers making a request conditional on the validators
+    of an earlier response
+    """
+    validators = validators or {}
+    headers = {}
+    if validators.get('ETag'):
+        headers['If-None-Match'] = validators['ETag']
+    if validators.get('Last-Modified'):
+        headers['If-Modified-Since'] = validators['Last-Modified']
+    return headers
+
+
+#-----------------------------------------------------------------------------#
+#                                   Caches                                    #
+#-----------------------------------------------------------------------------#
+class LRU:
+    """ thread-safe least-recently-used map of at most maxsize items """
+    def __init__(self, maxsize=LRU_SIZE):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.items:
+                return None
+            self.items.move_to_end(key)
+            return self.items[key]
+
+    def put(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            if len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def pop(self, key):
+        with self.lock:
+            return self.items.pop(key, None)
+
+
+class RecordCache:
+    """ (kind, key) : (value, fetched) in sqlite, behind an LRU
+
+    sqlite connections can't be shared between threads, so each thread
+    opens its own; the database is in WAL mode, so readers in other
+    processes don't block on writers.
+    """
+    def __init__(self, path=RECORDS_FILE, size=LRU_SIZE):
+        self.path = path
+        self.memory = LRU(size)
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._db() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS records ("
+                       "kind TEXT, key TEXT, value TEXT, fetched REAL, "
+                       "PRIMARY KEY (kind, key))")
+            db.execute("CREATE TABLE IF NOT EXISTS responses ("
+                       "url TEXT PRIMARY KEY, body BLOB, etag TEXT, "
+                       "last_modified TEXT, fetched REAL)")
+            db.execute("CREATE INDEX IF NOT EXISTS responses_fetched "
+                       "ON responses (fetched)")
+        self._stored = 0 # responses stored since the last pruning
+
+    def _db(self):
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = self.local.db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def get(self, kind, key, max_age=None):
+        """ cached value, or None if not cached (or older than max_age
+        seconds; default TTL[kind], or any age when offline)
+        """
+        if max_age is None:
+            max_age = float('inf') if OFFLINE else TTL[kind]
+        entry = self.entry(kind, key)
+        if entry is None:
+            return None
+        value, age = entry
+        return value if age <= max_age else None
+
+    def entry(self, kind, key):
+        """ (cached value, its age in seconds), or None if not cached """
+        entry = self.memory.get((kind, key))
+        metrics.cache_lookup('memory', entry is not None)
+        if entry is None:
+            row = self._db().execute(
+                "SELECT value, fetched FROM records WHERE kind=? AND key=?",
+                (kind, key)).fetchone()
+            metrics.cache_lookup('records', row is not None)
+            if row is None:
+                return None
+            entry = (json.loads(row[0]), row[1])
+            self.memory.put((kind, key), entry)
+        value, fetched = entry
+        return value, time.time() - fetched
+
+    def put(self, kind, key, value):
+        fetched = time.time()
+        self.memory.put((kind, key), (value, fetched))
+        with self._db() as db:
+            db.execute("INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?)",
+                       (kind, key, json.dumps(value), fetched))
+
+
+    #==== raw responses
+    def response(self, url):
+        """ (body, validators) of the stored response for url, or None """
+        row = self._db().execute(
+            "SELECT body, etag, last_modified FROM responses WHERE url=?",
+            (url,)).fetchone()
+        if row is None:
+            return None
+        body, etag, modified = row
+        validators = {k: v for k, v in (('ETag', etag),
+                                         ('Last-Modified', modified)) if v}
+        return body, validators
+
+    def put_response(self, url, body, validators):
+        with self._db() as db:
+            db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                       (url, body, validators.get('ETag'),
+                        validators.get('Last-Modified'), time.time()))
+        self._stored += 1
+        if self._stored >= PRUNE_EVERY:
+            self.prune_responses()
+
+    def prune_responses(self, max_count=RESPONSES_MAX, max_age=RESPONSES_AGE):
+        """ drop stored responses older than max_age seconds, and all but
+        the max_count most recent
+        """
+        self._stored = 0
+        with self._db() as db:
+            db.execute("DELETE FROM responses WHERE fetched < ?",
+                       (time.time() - max_age,))
+            db.execute("DELETE FROM responses WHERE url IN (SELECT url FROM "
+                       "responses ORDER BY fetched DESC LIMIT -1 OFFSET ?)",
+                       (max_count,))
+
+
+class Coalescer:
+    """ runs at most one call per key at a time; callers arriving while a
+    call for their key is in flight wait for it (up to their own timeout)
+    and share its result (or exception)
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.inflight = {}  # key : Future
+
+    def call(self, key, func, *args, timeout=None, **kwargs):
+        with self.lock:
+            future = self.inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self.inflight[key] = Future()
+        if not leader:
+            metrics.requests_coalesced.inc(kind=key[0])
+            try:
+                return future.result(timeout)
+            except FutureTimeout:
+                raise DeadlineExceeded(f"deadline exceeded waiting on {key}")
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.inflight[key]
+
+
+#-----------------------------------------------------------------------------#
+#                                  Interface                                  #
+#-----------------------------------------------------------------------------#
+_cache = None
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = RecordCache()
+    return _cache
@@ -0,0 +1,178 @@
+"""
+Bounded breadth-first crawl of the citation graph through Semantic Scholar.
+
+Starting from one paper, its SS `references` (and optionally `citations`)
+are fetched out to a given depth; every fetched paper goes into the local
+citation graph (see graph.py), which is handy for bootstrapping a
+literature review.
+
+The crawl
+  * fetches concurrently (`workers` threads) behind a shared rate limiter
+  * stops after `budget` requests in total
+  * never fetches a paper twice, checking all its aliases
+    (SS paperId, DOI, arXiv ID)
+  * checkpoints its frontier and visited set every CHECKPOINT_EVERY
+    fetches (and on interrupt), so it can be resumed
+"""
+import os
+import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from query import query_ss
+from timing import RateLimiter
+
+
+CHECKPOINT_EVERY = 25 # fetches between checkpoints
+
+
+def aliases(entry):
+    """ every id an SS paper entry may be known by """
+    ids = [entry.get('paperId'), entry.get('doi'), entry.get('arxivId')]
+    return [i.lower() if i.startswith('10.') else i for i in ids if i]
+
+def fetch_id(entry):
+    """ id to query SS with for an entry (None if it has no id) """
+    return entry.get('paperId') or entry.get('doi') or entry.get('arxivId')
+
+
+class Crawler:
+    """ breadth-first crawler over SS references/citations
+
+    Params
+    ------
+    graph : graph.CitationGraph
+        fetched papers, with their edges, are added here
+
+    checkpoint : str
+        path to the checkpoint file; an existing checkpoint for the same
+        seed is resumed
+
+    depth : int
+        max hops from the seed paper
+
+    citations : bool
+        also follow citations (papers citing each paper), not just references
+
+    budget : int
+        max number of requests for the whole crawl (across resumes)
+
+    workers : int
+        number of concurrent requests
+
+    rate : float
+        max requests per second
+    """
+    def __init__(self, graph, checkpoint, depth=2, citations=False,
+                 budget=500, workers=4, rate=1.0):
+        self.graph = graph
+        self.checkpoint = checkpoint
+        self.depth  = depth
+        self.citations = citations
+        self.budget  = budget
+        self.workers = workers
+        self.limiter = RateLimiter(rate, burst=workers)
+        self.seed = None
+        self.frontier = deque() # (fetch id, depth)
+        self.visited  = set()   # aliases of queued or fetched papers
+        self.failed   = []
+        self.used = 0           # requests spent
+        self.fetched = 0
+
+    #==== checkpoints
+    def save(self, in_flight=()):
+        """ write checkpoint; in-flight fetches are put back on the frontier """
+        self.graph.flush()
+        state = dict(seed=self.seed, depth=self.depth, citations=self.citations,
+                     used=self.used - len(in_flight), fetched=self.fetched,
+                     frontier=list(in_flight) + list(self.frontier),
+                     visited=sorted(self.visited), failed=self.failed)
+        tmp = f"{self.checkpoint}.tmp"
+        with open(tmp, 'w') as file:
+            json.dump(state, file)
+        os.replace(tmp, self.checkpoint)
+
+    def resume(self, seed):
+        """ load checkpoint for seed; returns whether there was one """
+        if not os.path.exists(self.checkpoint):
+            return False
+        with open(self.checkpoint) as file:
+            state = json.load(file)
+        if state['seed'] != seed:
+            return False
+        self.seed = seed
+        self.used = state['used']
+        self.fetched  = state['fetched']
+        self.frontier = deque(tuple(item) for item in state['frontier'])
+        self.visited  = set(state['visited'])
+        self.failed   = state['failed']
+        return True
+
+    #==== crawl
+    def _fetch(self, ref_id):
+        self.limiter.acquire()
+        return query_ss(ref_id)
+
+    def expand(self, response, depth):
+        """ queue the unseen neighbors of a fetched paper """
+        if depth >= self.depth:
+            return
+        neighbors = list(response.get('references') or [])
+        if self.citations:
+            neighbors += response.get('citations') or []
+        for entry in neighbors:
+            ref_id = fetch_id(entry)
+            ids = aliases(entry)
+            if ref_id is None or any(i in self.visited for i in ids):
+                continue
+            self.visited.update(ids)
+            self.frontier.append((ref_id, depth + 1))
+
+    def run(self, seed):
+        """ crawl from seed (resuming a checkpoint, if any) """
+        if not self.resume(seed):
+            self.seed = seed
+            self.frontier.append((seed, 0))
+            self.visited.add(seed.lower() if seed.startswith('10.') else seed)
+        pending = {} # future : (fetch id, depth)
+        since_checkpoint = 0
+        executor = ThreadPoolExecutor(self.workers)
+        try:
+            while self.frontier or pending:
+                #==== fill up workers
+                while self.frontier and len(pending) < self.workers \
+                      and self.used < self.budget:
+                    item = self.frontier.popleft()
+                    pending[executor.submit(self._fetch, item[0])] = item
+                    self.used += 1
+                if not pending:
+                    break # budget spent
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                #==== handle results (graph is only touched on this thread)
+                for future in done:
+                    ref_id, depth = pending.pop(future)
+                    try:
+                        response = future.result()
+                    except Exception as e:
+                        self.failed.append([ref_id, f"{type(e).__name__}: {e}"])
+                        continue
+                    self.graph.add_response(response, library=False)
+                    self.visited.update(aliases(response))
+                    self.fetched += 1
+                    self.expand(response, depth)
+                    print(f"  [{self.used}/{self.budget}] depth {depth}  "
+                          f"{response.get('title')}")
+                since_checkpoint += len(done)
+                if since_checkpoint >= CHECKPOINT_EVERY:
+                    self.save(pending.values())
+                    since_checkpoint = 0
+        except KeyboardInterrupt:
+            for future in pending:
+                future.cancel()
+            self.save(pending.values())
+            print(f"\n  interrupted; checkpoint saved to {self.checkpoint}")
+            raise
+        finally:
+            executor.shutdown(wait=False)
+        self.save()
+        return self.fetched
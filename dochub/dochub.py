@@ -9,17 +9,61 @@ using a custom reStructuredText template.
 """
 import os
 import sys
+import atexit
 import argparse
+import subprocess
 import pyperclip
 
-from query import query, get_citation_count
+import query as q
+import cache
 import documents
 import downloader
-from utils import PATH_PAPERS, PATH_NOTES, LIT_INBOX, LIT_BIBYML
+import mirrors
+import memprof
+import metrics
+from timing import Deadline
+from versions import VersionStore
+from utils import PATH_PAPERS, PATH_NOTES, LIT_INBOX, LIT_BIBYML, LIT_REFSIG
+from utils import LIT_BIBTEX
+from utils import LIT_GRAPH, LIT_SEARCH, LIT_FACETS, LIT_VERSIONS
+from utils import LIT_LIBRARY, LIT_MIRRORS
 
 # Parser
 # ------
-parser = argparse.ArgumentParser(description=__doc__)
+# options of every run, with or without a command (see configure)
+common = argparse.ArgumentParser(add_help=False)
+adg = common.add_argument
+
+adg('--deadline', type=float, default=None, metavar='SECONDS',
+    help=('time budget per paper (or download); optional info (abstract, '
+          'pdf link) is dropped if short on time'))
+
+adg('--service', default=os.environ.get('DOCHUB_SERVICE'), metavar='URL',
+    help=('look papers up through the lookup service at URL (see dochub.py '
+          'serve); default: $DOCHUB_SERVICE'))
+
+adg('--cached', action='store_true',
+    help=('look papers up in the local record cache first, querying only '
+          'on a miss; stale records are used at once and refreshed in the '
+          'background (see cache.py)'))
+
+adg('--offline', action='store_true',
+    help=('make no network requests; serve papers from local data only, '
+          'failing at once on a miss (also $DOCHUB_OFFLINE=1)'))
+
+adg('--hedge', action='store_true',
+    help='query SS and CrossRef at the same time for DOIs, merging results')
+
+adg('--memprof', nargs='?', default=None, const='memprof.txt', metavar='REPORT',
+    help='profile memory use across query stages, writing results to REPORT')
+
+adg('--metrics', default=None, metavar='TEXTFILE',
+    help='write run metrics to a Prometheus TEXTFILE at exit')
+
+adg('--metrics-interval', type=float, default=None, metavar='SECONDS',
+    help='also rewrite the metrics textfile during the run, every SECONDS')
+
+parser = argparse.ArgumentParser(description=__doc__, parents=[common])
 adg = parser.add_argument
 adg('ref_id', nargs='?', default=None,
     help=('ArXiv ID or DOI for a paper'))
@@ -51,13 +95,58 @@ def add_to_inbox(ref_id, inbox_file=LIT_INBOX):
 #def get_info(ref_id):
 #    info = query(ref_id)
 #    return info
-get_info = lambda ref_id: query(ref_id)
+def configure(args):
+    """ apply the common options (see `common`) of a run """
+    global _service, _cached
+    if args.memprof is not None:
+        memprof.enable(args.memprof)
+    if args.metrics is not None:
+        metrics.configure(args.metrics, args.metrics_interval)
+    if args.hedge:
+        q.HEDGE = True
+    if args.offline:
+        cache.OFFLINE = True
+    _cached = args.cached
+    if args.service:
+        import service
+        _service = service.Client(args.service)
+
+_service  = None  # service.Client, if looking up through a service
+_cached   = False # --cached
+_resolver = None  # service.Resolver, once needed
 
-def get_paper(info, write_path, overwrite=True):
+def lookups():
+    """ the lookup service client; else, with --cached, a local resolver
+    over the record cache; else direct queries
+    """
+    global _resolver
+    import service
+    if _service is not None:
+        return _service
+    if not _cached:
+        return service.Direct()
+    if _resolver is None:
+        _resolver = service.Resolver(serve_stale=True)
+        atexit.register(_resolver.drain)
+    return _resolver
+
+get_info = lambda ref_id, deadline=None, fresh=False: \
+    lookups().query(ref_id, deadline, fresh)
+
+def get_paper(info, write_path, overwrite=True, deadline=None):
     #==== file path
     paper_filename = info['filename'] + '.pdf'
     paper_path     = f"{write_path}/{paper_filename}"
+    arx_id = info.get('arxivId')
+    versions = VersionStore(LIT_VERSIONS)
+    if arx_id and versions.is_current(arx_id, info.get('version')) \
+       and versions.get(arx_id)['path'] == os.path.abspath(paper_path):
+        print(f"  {paper_filename} is up to date (v{info.version})")
+        return
     if file_exists(paper_path):
+        if cache.OFFLINE:
+            print(f"  {paper_filename} already exists (offline, keeping it)")
+            return
         print(f"  {paper_filename} already exists!\n"
                "  proceeding to overwrite")
     #==== download
@@ -68,20 +157,21 @@ def get_paper(info, write_path, overwrite=True):
     #        raise ValueError('No valid reference ID available for download')
     #    ref_id = info['DOI']
     #downloader.download(ref_id, paper_path)
-    downloader.download_from_response(info, paper_path)
+    validators = downloader.download_from_response(info, paper_path, deadline)
+    if arx_id and 'version' in info:
+        versions.record(arx_id, info.version, info.updated, paper_path,
+                        validators)
+        versions.save()
 
 def gen_notes(info, write_path):
-    notes_filename = info['filename'] + '.rst'
-    notes_path = f"{write_path}/{notes_filename}"
-    #==== file path
-    if not file_exists(notes_path):
-        notes = documents.Document(info)
-        notes.generate_notes()
-    else:
+    try:
+        documents.Document(info, write_path).generate_notes()
+    except FileExistsError:
         print('Notes already exist!')
 
 def get_citation(info, write_to_bib=False):
-    bib = documents.make_bib_entry(info)
+    with memprof.stage('make_bib_entry'):
+        bib = documents.make_bib_entry(info)
     print(bib)
     pyperclip.copy(bib)
     return bib
@@ -90,21 +180,657 @@ def get_link_from_clipboard():
     url = pyperclip.paste()
     return url
 
+class Indexes:
+    """ the library store and its indexes (references, text, facets),
+    loaded once to add any number of papers, then saved together
+    """
+    def __init__(self):
+        import library, similarity, search, facets
+        self.library    = library.Library(LIT_LIBRARY)
+        self.references = similarity.LSHIndex.load(LIT_REFSIG)
+        self.text       = search.SearchIndex.load(LIT_SEARCH)
+        self.facets     = facets.FacetIndex.load(LIT_FACETS)
+
+    def add(self, info):
+        """ add a paper's record, reference set (to the similarity index),
+        title, abstract and keywords (to the search index), and year,
+        venue, topics and authors (to the facet index)
+        """
+        import similarity
+        key = q.paper_key(info)
+        self.library.add(key, info)
+        if info.get('references'):
+            self.references.add(key, similarity.signature(info['references']))
+        self.text.add_paper(info)
+        self.facets.add(key, info)
+
+    def save(self):
+        self.library.maybe_compact()
+        self.references.save(LIT_REFSIG)
+        self.text.save(LIT_SEARCH)
+        self.facets.save(LIT_FACETS)
+
+def open_graph(graph_path=LIT_GRAPH, record=True):
+    """ load the local citation graph; if record, SS responses from
+    queries are added to it (call graph.flush() to write them)
+    """
+    import graph
+    store = graph.CitationGraph(graph_path)
+    if record:
+        q.ss_response_hooks.append(store.add_response)
+    return store
+
+
+def add_paper(ref_id, deadline=None, download=None, notes=None,
+              citation_graph=None, info=None, indexes=None):
+    """ query a paper, print (and copy) its citation, add it to the library
+    indexes, and optionally download it (to dir download) and generate
+    notes (in dir notes); info, if given, is used instead of querying
+
+    indexes (Indexes), if given, are added to and left for the caller to
+    save, so many papers can be added with one load and save of each
+    index; otherwise the indexes are loaded and saved for this paper.
+    """
+    with memprof.record(ref_id):
+        if info is None: # (revalidated if cached, to download the current pdf)
+            info = get_info(ref_id, deadline, fresh=download is not None)
+
+        # Citation
+        citation = get_citation(info, )#write_to_bib=True)
+
+    # Library record and indexes
+    if indexes is not None:
+        indexes.add(info)
+    else:
+        indexes = Indexes()
+        indexes.add(info)
+        indexes.save()
+    if citation_graph is not None:
+        citation_graph.flush()
+
+    # Download
+    if download is not None:
+        dpath = download
+        if dpath != PATH_PAPERS:
+            dpath = os.path.abspath(dpath)
+        get_paper(info, dpath, deadline=deadline)
+
+    # Notes
+    if notes is not None:
+        npath = notes
+        if npath != PATH_NOTES:
+            npath = os.path.abspath(npath)
+        gen_notes(info, npath)
+    return info
+
+
+#-----------------------------------------------------------------------------#
+#                                  Commands                                   #
+#-----------------------------------------------------------------------------#
+# Commands are run as `dochub.py <command> [args]`, see `dochub.py <command> -h`
+commands = argparse.ArgumentParser(prog='dochub.py')
+subparsers = commands.add_subparsers(dest='command')
+
+def argp(*names_or_flags, **kwargs):
+    """ subparser args """
+    return names_or_flags, kwargs
+
+def subcmd(*parser_args, parent=subparsers, name=None):
+    """Decorator to define a new subcommand in a sanity-preserving way.
+
+    The function is stored in the ``func`` variable when the parser
+    parses arguments so that it can be called directly like so::
+        args = commands.parse_args()
+        args.func(args)
+
+    Command names are the function name, with '_' as '-', unless given.
+    Every command also takes the common options (see configure).
+    """
+    def decorator(func):
+        command = name or func.__name__.replace('_', '-')
+        parser = parent.add_parser(command, description=func.__doc__,
+                                   parents=[common])
+        for args, kwargs in parser_args:
+            parser.add_argument(*args, **kwargs)
+        parser.set_defaults(func=func)
+        return func
+    return decorator
+
+
+@subcmd(argp('ref_id', nargs='?', default=None,
+             help='ArXiv ID or DOI of paper; queried if not in library index'),
+        argp('-k', type=int, default=10, help='number of papers to list'),
+        argp('--dupes', action='store_true',
+             help='list near-duplicate pairs in the library instead'),
+        argp('-t', '--threshold', type=float, default=None,
+             help='min similarity (default 0 for similar, 0.8 for --dupes)'))
+def similar(args):
+    """ list papers in the library with the most similar references """
+    import similarity
+    index = similarity.LSHIndex.load(LIT_REFSIG)
+    if args.dupes:
+        threshold = 0.8 if args.threshold is None else args.threshold
+        for key_a, key_b, score in index.near_duplicates(threshold):
+            print(f"  {score:.2f}  {key_a}  {key_b}")
+        return
+    ref_id = args.ref_id or get_link_from_clipboard()
+    threshold = args.threshold or 0.0
+    key = q.normalize_id(ref_id)
+    if key in index:
+        hits = index.similar_to(key, args.k, threshold)
+    else:
+        info = get_info(ref_id)
+        sig  = similarity.signature(info.get('references', []))
+        hits = index.query(sig, args.k, threshold, exclude=q.paper_key(info))
+    for other, score in hits:
+        print(f"  {score:.2f}  {other}")
+
+
+@subcmd(argp('ref_id', nargs='?', default=None,
+             help='SS paperId, arXiv ID or DOI of a paper in the graph'),
+        argp('--two-hop', nargs='?', default=None, const='both',
+             choices=['out', 'in', 'both'],
+             help=('list papers two hops away, following references (out), '
+                   'citations (in) or both')),
+        argp('--compact', action='store_true',
+             help='rebuild the graph adjacency arrays'))
+def graph(args):
+    """ query the local citation graph; by default, list the papers in
+    the library citing the given paper
+    """
+    store = open_graph(record=False)
+    if args.compact:
+        store.compact()
+        print(f"  {len(store.keys)} papers, {store.num_compacted} citations")
+        return
+    ref_id = q.normalize_id(args.ref_id or get_link_from_clipboard())
+    if args.two_hop:
+        nodes = store.two_hop(ref_id, args.two_hop)
+    else:
+        nodes = store.cited_by_library(ref_id)
+    for node in nodes:
+        key, year, title = store.describe(node)
+        print(f"  {key:<40}  {year:>4}  {title}")
+
+
+@subcmd(argp('ref_id', nargs='?', default=None,
+             help='seed paper (SS paperId, arXiv ID or DOI in the graph)'),
+        argp('-m', '--method', default='all',
+             choices=['cocite', 'couple', 'ppr', 'all'],
+             help=('co-citation, bibliographic coupling, personalized '
+                   'pagerank, or all combined')),
+        argp('-k', type=int, default=20, help='number of papers to list'))
+def related(args):
+    """ rank papers related to the library (or to a paper), using the
+    local citation graph
+    """
+    import related as rel
+    store = open_graph(record=False)
+    for node, score in rel.rank(store, args.ref_id, args.method, args.k):
+        key, year, title = store.describe(node)
+        print(f"  {score:8.4f}  {key:<40}  {year:>4}  {title}")
+
+
+@subcmd(argp('ref_id', help='ArXiv ID or DOI of the paper to start from'),
+        argp('-k', '--depth', type=int, default=2,
+             help='max hops from the starting paper'),
+        argp('--citations', action='store_true',
+             help='also follow citations, not just references'),
+        argp('-b', '--budget', type=int, default=500,
+             help='max number of API requests for the whole crawl'),
+        argp('-w', '--workers', type=int, default=4,
+             help='number of concurrent requests'),
+        argp('-r', '--rate', type=float, default=1.0,
+             help='max requests per second'),
+        argp('--checkpoint', default=None, metavar='PATH',
+             help='checkpoint file (default: in the graph dir)'),
+        argp('--restart', action='store_true',
+             help='ignore any existing checkpoint'))
+def crawl(args):
+    """ breadth-first crawl of a paper's references (and citations)
+    into the local citation graph; interrupted crawls resume from their
+    checkpoint
+    """
+    from crawl import Crawler
+    ref_id = q.normalize_id(args.ref_id)
+    checkpoint = args.checkpoint
+    if checkpoint is None:
+        checkpoint = f"{LIT_GRAPH}/crawl-{ref_id.replace('/', '_')}.json"
+    if args.restart and file_exists(checkpoint):
+        os.remove(checkpoint)
+    crawler = Crawler(open_graph(record=False), checkpoint, args.depth,
+                      args.citations, args.budget, args.workers, args.rate)
+    fetched = crawler.run(ref_id)
+    print(f"\n  crawled {fetched} papers with {crawler.used} requests "
+          f"({len(crawler.failed)} failed, {len(crawler.frontier)} left "
+          f"in frontier)")
+
+
+@subcmd(argp('ref_ids', nargs='*', metavar='ref_id',
+             help='papers to sync (default: all library papers in the graph)'),
+        argp('-r', '--rate', type=float, default=1.0,
+             help='max requests per second'))
+def sync_citations(args):
+    """ find papers newly citing library papers since the last sync,
+    fetching only citation counts and the new citations
+    """
+    from sync import CitationSync
+    from timing import RateLimiter
+    store = open_graph(record=False)
+    ref_ids = args.ref_ids or [store.keys[n] for n in sorted(store.library)]
+    ref_ids = [q.normalize_id(r) for r in ref_ids]
+    syncer = CitationSync(store, RateLimiter(args.rate))
+    results = syncer.sync_all(ref_ids)
+    for ref_id, new in results.items():
+        if not new:
+            continue
+        print(f"\n  {ref_id}: {len(new)} new citing papers")
+        for paper in new:
+            print(f"    {paper['paperId']:<40}  {paper.get('year') or '':>4}  "
+                  f"{paper.get('title')}")
+    total = sum(len(new) for new in results.values())
+    print(f"\n  {total} new citing papers for {len(results)} papers "
+          f"({syncer.requests} requests)")
+
+
+@subcmd(argp('path', help='arXiv metadata snapshot (JSON lines)'))
+def ingest_snapshot(args):
+    """ index a local arXiv metadata snapshot, so arXiv metadata and
+    abstracts are read from it rather than the arXiv API
+    """
+    import time
+    import snapshot
+    start = time.time()
+    count = snapshot.ingest(args.path)
+    print(f"  indexed {count} records in {time.time() - start:.0f}s")
+
+
+def parse_selection(text, n):
+    """ indices (from 0) picked by text such as '1-3 7' or 'all', of n;
+    ValueError if text has anything else
+    """
+    if text.strip().lower() == 'all':
+        return list(range(n))
+    picked = []
+    for part in text.replace(',', ' ').split():
+        lo, _, hi = part.partition('-')
+        if not (lo.isdigit() and (hi.isdigit() or not hi)):
+            raise ValueError(f"not a number or range: {part!r}")
+        picked += [i - 1 for i in range(int(lo), int(hi or lo) + 1)
+                   if 0 < i <= n and i - 1 not in picked]
+    return picked
+
+def search_arxiv(args):
+    """ list arXiv search hits as they stream in; then inbox or add the
+    ones picked (all of them if stdin is not a terminal)
+    """
+    hits = []
+    for info in q.search_arxiv(' '.join(args.terms), args.k, args.sort):
+        hits.append(info.arxivId)
+        if args.ids:
+            print(info.arxivId, flush=True)
+            continue
+        title = ' '.join(info.title.split())
+        print(f"  [{len(hits)}] {info.arxivId}  {info.year}  {title}", flush=True)
+    if not (hits and (args.inbox or args.add)):
+        return
+    picked = range(len(hits))
+    while sys.stdin.isatty():
+        try:
+            picked = parse_selection(
+                input("\n  papers to take (eg 1-3 7, all): "), len(hits))
+            break
+        except ValueError as e:
+            print(f"  {e}")
+    indexes = Indexes() if args.add else None
+    try:
+        for i in picked:
+            if args.inbox:
+                add_to_inbox(hits[i])
+            if args.add:
+                try:
+                    add_paper(hits[i], Deadline(args.deadline),
+                              indexes=indexes)
+                except Exception as e:
+                    print(f"  ERROR: {e}")
+    finally:
+        if indexes is not None:
+            indexes.save()
+
+
+@subcmd(argp('terms', nargs='+', help='search terms'),
+        argp('-k', type=int, default=10, help='number of hits to list'),
+        argp('--notes', default=PATH_NOTES, metavar='NPATH',
+             help='notes directory to search (default: %(default)s)'),
+        argp('--arxiv', action='store_true',
+             help=('search arXiv instead (API syntax, eg ti:transformer AND '
+                   'cat:cs.LG), streaming the hits as they come')),
+        argp('--sort', default='relevance',
+             choices=['relevance', 'lastUpdatedDate', 'submittedDate'],
+             help='order of arXiv hits (default: %(default)s)'),
+        argp('--ids', action='store_true',
+             help='only print the arXiv IDs of the hits (eg for batch -)'),
+        argp('--inbox', action='store_true',
+             help='add the arXiv hits picked to the inbox'),
+        argp('--add', action='store_true',
+             help='add the arXiv hits picked to the library'))
+def search(args):
+    """ ranked full-text search over the titles, abstracts and keywords of
+    queried papers, and the notes; or, with --arxiv, an arXiv search
+    """
+    if args.arxiv:
+        return search_arxiv(args)
+    import search as fts
+    index = fts.SearchIndex.load(LIT_SEARCH)
+    if index.update_notes(args.notes):
+        index.save(LIT_SEARCH)
+    for score, doc in index.search(' '.join(args.terms), args.k):
+        where = doc.get('path') or doc.get('key') or ''
+        print(f"  {score:6.2f}  {doc.get('title') or doc['name']}\n"
+              f"          {where}")
+
+
+@subcmd(argp('filter', nargs='*',
+             help=('filter, eg: topic=Reinforcement Learning AND year>=2018 '
+                   'AND author~botvinick (fields: year, venue, publisher, '
+                   'topic, author)')),
+        argp('--rebuild', action='store_true',
+             help='rebuild the facet index from the library records first'),
+        name='list')
+def list_papers(args):
+    """ list library papers matching a filter over year, venue, publisher,
+    topic and author, newest first
+    """
+    import facets
+    if args.rebuild:
+        import library
+        index = facets.FacetIndex.rebuild(library.Library(LIT_LIBRARY).load())
+        index.save(LIT_FACETS)
+    else:
+        index = facets.FacetIndex.load(LIT_FACETS)
+    try:
+        papers = index.select(' '.join(args.filter))
+    except ValueError as e:
+        sys.exit(f"  {e}")
+    for key, year, title in papers:
+        print(f"  {key:<28}  {year or '':>4}  {title}")
+    print(f"\n  {len(papers)} of {len(index)} papers")
+
+
+def scan_sources(paths):
+    """ (kind, id) found in files at paths ('-' for stdin) """
+    import extract
+    for path in paths:
+        yield from extract.scan_file(sys.stdin if path == '-' else path)
+
+def collect_ids(found):
+    """ unique ref ids, in order, from (kind, id) pairs (see extract.scan) """
+    import extract
+    ref_ids = []
+    for kind, ref_id in found:
+        ref_id = extract.strip_version(ref_id) if kind == 'arxiv' else ref_id
+        if ref_id not in ref_ids:
+            ref_ids.append(ref_id)
+    return ref_ids
+
+
+@subcmd(argp('files', nargs='*', metavar='FILE',
+             help=('text, html, .bib, ... files to take IDs from; '
+                   "'-' for stdin (default: the clipboard)")),
+        argp('--ids', action='store_true',
+             help='only list the IDs found, without querying them'),
+        argp('-d', '--download', nargs='?', default=None, const=PATH_PAPERS,
+             metavar='DPATH', help='download each paper (see dochub.py -h)'),
+        argp('-n', '--notes', nargs='?', default=None, const=PATH_NOTES,
+             metavar='NPATH', help='generate notes for each paper'),
+        argp('--crossref', action='store_true',
+             help=('look up all DOIs in batched CrossRef queries (by default '
+                   'only those that SS is known to miss)')),
+        argp('-j', '--jobs', type=int, default=None,
+             help=('processes for processing CrossRef responses '
+                   '(default: one per core)')))
+def batch(args):
+    """ add every arXiv ID and DOI found in the given files (eg, a reading
+    list, a reference section or a .bib file) to the library
+    """
+    import extract
+    if not args.files:
+        ref_ids = collect_ids(extract.scan_text(get_link_from_clipboard()))
+    else:
+        ref_ids = collect_ids(scan_sources(args.files))
+    if args.ids:
+        print('\n'.join(ref_ids))
+        return
+    # DOIs for crossref, resolved many per request
+    dois = [r for r in ref_ids if q.is_doi(r)
+            and (args.crossref or q.routing.route(r)[0] == 'crossref')]
+    prefetched = {}
+    if dois:
+        try:
+            prefetched = q.query_crossref_many(dois, jobs=args.jobs)
+        except Exception as e:
+            print(f"  batched CrossRef query failed ({e}); querying one by one")
+    citation_graph = open_graph()
+    indexes = Indexes()
+    failed, added = [], []
+    try:
+        for i, ref_id in enumerate(ref_ids):
+            print(f"\n[{i+1}/{len(ref_ids)}] {ref_id}")
+            try:
+                added.append(add_paper(ref_id, Deadline(args.deadline),
+                                       args.download, None, citation_graph,
+                                       prefetched.get(ref_id), indexes))
+            except Exception as e:
+                print(f"  ERROR: {e}")
+                failed.append(ref_id)
+    finally: # (also when interrupted, keeping the papers added so far)
+        indexes.save()
+    print(f"\n  added {len(added)} of {len(ref_ids)} papers")
+    if failed:
+        print(f"  failed: {' '.join(failed)}")
+    if args.notes is not None:
+        written, _ = documents.generate_notes_bulk(
+            added, os.path.abspath(args.notes))
+        print(f"  wrote notes for {len(written)} papers")
+
+
+@subcmd(argp('-n', '--dry-run', action='store_true',
+             help='only list papers with a newer version'))
+def check_updates(args):
+    """ check downloaded arXiv papers for newer versions (with batched
+    arXiv API queries), and re-download only those that have one
+    """
+    versions = VersionStore(LIT_VERSIONS)
+    responses = q.query_arxiv_batch(list(versions.papers))
+    stale = []
+    for arx_id, paper in versions.papers.items():
+        if arx_id not in responses:
+            print(f"  {arx_id}: not found on arXiv")
+            continue
+        version, updated = q.arxiv_version(responses[arx_id])
+        if version > paper['version']:
+            stale.append((arx_id, version, updated))
+            print(f"  {arx_id}: v{paper['version']} --> v{version}  "
+                  f"({updated[:10]})  {paper['path']}")
+    print(f"\n  {len(stale)} of {len(versions.papers)} papers have a new version")
+    if args.dry_run:
+        return
+    for arx_id, version, updated in stale:
+        paper = versions.get(arx_id)
+        headers = downloader.conditional_headers(paper.get('validators'))
+        try:
+            sources = mirrors.get_mirrors(LIT_MIRRORS).sources_for(
+                dict(pdf=q.arxiv_pdf(arx_id)))
+            validators = downloader.retrieve_any(sources, paper['path'],
+                                                 Deadline(args.deadline), headers)
+        except Exception as e:
+            print(f"  ERROR downloading {arx_id}: {e}")
+            continue
+        if validators is None: # kept as stale, to be tried again next run
+            print(f"  {arx_id}: pdf not modified")
+            continue
+        print(f"  {arx_id}: downloaded v{version}")
+        versions.record(arx_id, version, updated, paper['path'], validators)
+        versions.save()
+
+
+@subcmd(argp('path', nargs='?', default=LIT_BIBYML,
+             help='YAML file (default: %(default)s)'),
+        argp('--import', dest='import_', action='store_true',
+             help='add the entries of the YAML file to the library instead'),
+        argp('-j', '--jobs', type=int, default=None,
+             help='processes for (de)serializing (default: one per core)'))
+def export_yaml(args):
+    """ write the library records out as a YAML bibliography (or, with
+    --import, read one into the library)
+    """
+    import library
+    store = library.Library(LIT_LIBRARY)
+    if args.import_:
+        count = store.import_yaml(args.path, args.jobs)
+        print(f"  added {count} entries from {args.path}")
+    else:
+        store.export_yaml(args.path, args.jobs)
+        print(f"  wrote {len(store)} entries to {args.path}")
+
+
+@subcmd(argp('path', nargs='?', default=LIT_BIBTEX,
+             help='bibtex file (default: %(default)s)'),
+        argp('-j', '--jobs', type=int, default=None,
+             help='processes for rendering (default: one per core)'))
+def export_bib(args):
+    """ write the library records out as a bibtex file """
+    import library
+    store = library.Library(LIT_LIBRARY)
+    store.export_bib(args.path, args.jobs)
+    print(f"  wrote {len(store)} entries to {args.path}")
+
+
+@subcmd(argp('sources', nargs='*', metavar='ID_OR_FILE',
+             help="arXiv IDs, DOIs, or files to take IDs from ('-' for stdin)"),
+        argp('--library', action='store_true',
+             help='prefetch every paper in the library'),
+        argp('-d', '--download', nargs='?', default=None, const=PATH_PAPERS,
+             metavar='DPATH', help='also download the pdfs (see dochub.py -h)'),
+        argp('--rate', type=float, default=1.0,
+             help='papers fetched per second (default: %(default)s)'),
+        argp('-j', '--jobs', type=int, default=4,
+             help='papers fetched at the same time'),
+        argp('--background', action='store_true',
+             help='run detached, logging to .cache/prefetch.log'))
+def prefetch(args):
+    """ fetch metadata, abstracts, citation counts (and pdfs) into the local
+    caches, throttled, so the papers can be looked up offline (--offline)
+    """
+    import extract
+    from concurrent.futures import ThreadPoolExecutor
+    from timing import RateLimiter
+    if args.background:
+        os.makedirs(q.routing.CACHE_DIR, exist_ok=True)
+        log_path = f"{q.routing.CACHE_DIR}/prefetch.log"
+        argv = [a for a in sys.argv if a != '--background']
+        with open(log_path, 'a') as log:
+            proc = subprocess.Popen([sys.executable] + argv, stdout=log,
+                                    stderr=subprocess.STDOUT,
+                                    start_new_session=True)
+        print(f"  prefetching in the background (pid {proc.pid}); "
+              f"log: {log_path}")
+        return
+    files = [s for s in args.sources if s == '-' or os.path.isfile(s)]
+    found = [extract.parse_id(s) for s in args.sources if s not in files]
+    ref_ids = collect_ids([f for f in found if f[0]] + list(scan_sources(files)))
+    if args.library:
+        import library
+        ref_ids += [k for k in library.Library(LIT_LIBRARY).keys()
+                    if k not in ref_ids]
+    import service
+    # (stale records are refetched, rather than served and refreshed)
+    resolver = _service or service.Resolver()
+    limiter = RateLimiter(args.rate)
+    dpath = args.download and os.path.abspath(args.download)
+
+    def fetch(ref_id):
+        limiter.acquire()
+        info = resolver.query(ref_id)
+        resolver.citation_counts(ref_id)
+        if dpath and not file_exists(f"{dpath}/{info['filename']}.pdf"):
+            get_paper(info, dpath)
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        for ref_id, future in [(r, pool.submit(fetch, r)) for r in ref_ids]:
+            try:
+                future.result()
+                print(f"  {ref_id}")
+            except Exception as e:
+                print(f"  {ref_id} ERROR: {str(e).strip()}")
+                failed.append(ref_id)
+    print(f"\n  prefetched {len(ref_ids) - len(failed)} of {len(ref_ids)} papers")
+
+
+@subcmd(argp('--host', default='127.0.0.1'),
+        argp('--port', type=int, default=8765))
+def serve(args):
+    """ serve paper lookups, citation counts and bib entries over HTTP to
+    local clients (see service.py), sharing one cache and one upstream
+    request per paper between them
+    """
+    import service
+    service.serve(args.host, args.port)
+
+
+@subcmd(argp('path', nargs='?', default=PATH_NOTES,
+             help='notes directory (default: %(default)s)'),
+        argp('-j', '--jobs', type=int, default=8,
+             help='files written in parallel'))
+def notes(args):
+    """ generate notes for every library paper that has none yet """
+    import library
+    records = library.Library(LIT_LIBRARY).load().values()
+    written, skipped = documents.generate_notes_bulk(
+        [r for r in records if r.get('filename') and r.get('title')],
+        os.path.abspath(args.path), args.jobs)
+    print(f"  wrote {len(written)} notes ({len(skipped)} already existed)")
+
+
+@subcmd(argp('ref_id', help='arXiv ID or DOI of a paper in the library'))
+def authors(args):
+    """ print all authors of a paper (in full, for large collaborations) """
+    import library
+    ref_id = q.normalize_id(args.ref_id)
+    info = library.Library(LIT_LIBRARY).get(ref_id)
+    if info is None:
+        print(f"  {ref_id} is not in the library")
+        return 1
+    for name in q.full_authors(info):
+        print(name)
+
+
 
 if __name__ == '__main__':
-    parser = utils.PARSER
-    parser.description = __doc__
+    if len(sys.argv) > 1 and sys.argv[1] in subparsers.choices:
+        args = commands.parse_args()
+        configure(args)
+        sys.exit(args.func(args))
+
     args = parser.parse_args()
+    configure(args)
     if args.ref_id is None:
         ref_id = get_link_from_clipboard()
         #sys.exit()
         #ref_id = utils.read_inbox_file()
     else:
         ref_id = args.ref_id
+    ref_id = q.normalize_id(ref_id)
 
     # count citations
     if args.count_citations:
-        get_citation_count(ref_id)
+        try:
+            counts = lookups().citation_counts(ref_id)
+        except Exception as e:
+            print(f"\nERROR: No citation counts found for {ref_id} ({e})")
+            sys.exit(1)
+        q.print_citation_counts(ref_id, counts)
         sys.exit()
 
     # Inbox only?
@@ -112,24 +838,6 @@ if __name__ == '__main__':
         add_to_inbox(ref_id)
         #sys.exit()
 
-    # Query
-    info = get_info(ref_id)
-
-    # Citation
-    citation = get_citation(info, )#write_to_bib=True)
-
-    # Download
-    if args.download is not None:
-        dpath = args.download
-        if dpath != PATH_PAPERS:
-            dpath = os.path.abspath(dpath)
-        get_paper(info, dpath)
-
-    # Notes
-    if args.notes is not None:
-        npath = args.notes
-        if npath != PATH_NOTES:
-            npath = os.path.abspath(npath)
-        gen_notes(info, npath)
-
-
+    # Query, index, download, notes
+    add_paper(ref_id, Deadline(args.deadline), args.download, args.notes,
+              open_graph())
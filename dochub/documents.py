@@ -1,5 +1,7 @@
 import os
 import code
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from collections import OrderedDict
 from pybtex.database import BibliographyData, Entry
 import yaml
@@ -14,6 +16,16 @@ now need to make functions for bibtex, that is actually valid bibtex
 #-----------------------------------------------------------------------------#
 #                                Bibliography                                 #
 #-----------------------------------------------------------------------------#
+def format_authors(info):
+    """ author list as one string, with "et al." if it was truncated
+    (large collaborations, see query.set_authors)
+    """
+    authors = ', '.join(info.get('author', []))
+    if info.get('author_count', 0) > len(info.get('author', [])):
+        authors += ', et al.'
+    return authors
+
+
 def make_bib_entry(info, style='bibtex'):
     """ Makes a bibliography entry from the processed api info
 
@@ -38,7 +50,8 @@ def make_bib_entry(info, style='bibtex'):
     #==== add fields
     add_field('year')
     add_field('title')
-    add_field('author')
+    if 'author' in info:
+        fields['author'] = format_authors(info)
     add_field('arxivId')
     add_field('DOI')
     add_field('keywords')
@@ -126,51 +139,110 @@ class Document:
         self.filename = f"{path}/{info['filename']}.rst"
 
     def format_keywords(self):
-        kw = ''
-        if 'keywords' in self.info:
-            kw = ', '.join([w.lower() for w in self.info['keywords']])
-        return kw
+        return _format_keywords(self.info)
 
     def format_abs(self):
-        abstract = '(Unavailable)'
-        if 'abstract' in self.info:
-            abstract = _TAB.join(self.info['abstract'].split('\n'))
-        return abstract
+        return _format_abs(self.info)
 
     def generate_notes(self):
-        assert not os.path.exists(self.filename) # don't overwrite notes
-        # get content of interest
-        info = self.info
-        title   = info['title']
-        authors = ", ".join(info['author'])
-        year    = info['year']
-        url     = info['URL']
-        keywords = self.format_keywords()
-        abstract = self.format_abs()
-        eprint   = info['arxivId'] if 'arxivId' in info else info['DOI']
-
-        # write file
-        line = Line()
-        file = open(self.filename, 'w')
-        wr = lambda s: file.write(s + '\n')
+        """ write the notes file; FileExistsError if it already exists """
+        write_new(self.filename, render_notes(self.info))
+
+
+# Bulk rendering
+# ==============
+def _format_keywords(info):
+    return ', '.join([w.lower() for w in info.get('keywords', [])])
+
+def _format_abs(info):
+    if 'abstract' not in info:
+        return '(Unavailable)'
+    return _TAB.join(info['abstract'].split('\n'))
+
+
+def _compile_template():
+    """ the notes layout as one format string; only the title section
+    depends on the record (its underline has the title's length)
+    """
+    line = Line()
+    parts = [
         #==== Header: keywords, title, authors
-        wr(_META)
-        wr(f"{_KEYWORDS} {keywords}")
-        wr(_N)
-        wr(line(title, 0))
-        wr("\n| **Authors:**")
-        wr(f"| {authors}")
-        wr(_N)
+        _META, f"{_KEYWORDS} {{keywords}}", _N, "{title}",
+        "\n| **Authors:**", "| {authors}", _N,
         #==== Body: <oneliner>, abstract, <notes area>, year, eprint, url
-        wr(ONELINER + '\n')
-        wr(ABS.format(abstract))
-        wr(line('Key Points', 2))
-        wr(_N)
-        wr(line('Additional Notes', 3))
-        wr(_N)
-        wr(line('Reference', 2))
-        wr(f":year: {year}")
-        wr(f":eprint: {eprint}")
-        wr(f":link: {url}")
-        wr(_N)
-        file.close()
+        ONELINER + '\n', ABS.format('{abstract}'),
+        line('Key Points', 2), _N, line('Additional Notes', 3), _N,
+        line('Reference', 2), ":year: {year}", ":eprint: {eprint}",
+        ":link: {url}", _N]
+    return ''.join(part + '\n' for part in parts)
+
+NOTES_TEMPLATE = _compile_template()
+_LINE = Line()
+
+
+def render_notes(info):
+    """ the notes of one processed paper, as a string """
+    return NOTES_TEMPLATE.format(
+        keywords = _format_keywords(info),
+        title    = _LINE(info['title'], 0),
+        authors  = format_authors(info),
+        abstract = _format_abs(info),
+        year     = info.get('year', ''),
+        eprint   = info.get('arxivId') or info.get('DOI', ''),
+        url      = info.get('URL', ''))
+
+
+def write_new(path, text):
+    """ atomically create path with text; FileExistsError if path exists
+
+    The text goes to a temp file that is then hard-linked into place, so a
+    reader never sees a partial file, and existing notes are never
+    overwritten (the link fails instead).
+    """
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, 'w') as file:
+        file.write(text)
+    try:
+        os.link(tmp, path)
+    finally:
+        os.remove(tmp)
+
+
+def generate_notes_bulk(infos, path=PATH_NOTES, workers=8):
+    """ write notes for many papers, skipping those that already have notes
+
+    The notes directory is listed once (rather than stat'ed per paper),
+    records are rendered in memory, and files are written from a thread
+    pool.
+
+    Returns
+    -------
+    written : list
+        filenames of the notes written
+    skipped : list
+        filenames of the notes that already existed
+    """
+    os.makedirs(path, exist_ok=True)
+    with os.scandir(path) as entries:
+        existing = {entry.name for entry in entries}
+    todo, skipped = {}, []
+    for info in infos:
+        name = f"{info['filename']}.rst"
+        if name in existing or name in todo:
+            skipped.append(name)
+        else:
+            todo[name] = render_notes(info)
+
+    def write(name):
+        try:
+            write_new(f"{path}/{name}", todo[name])
+            return name
+        except FileExistsError: # created since the listing
+            return None
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        done = list(pool.map(write, todo))
+    written = [name for name in done if name is not None]
+    created = set(written)
+    skipped += [name for name in todo if name not in created]
+    return written, skipped
@@ -12,19 +12,186 @@ Papers that are not published to arXiv are identified instead by their doi.
 Generally, doi papers are behind a journal paywall, so libgen is provided.
 """
 
+import os
 import sys
 import code
+import time
 import requests
 from lxml import html
 from lxml.etree import ParserError
-from urllib.request import urlretrieve
-from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.request import urlopen, Request
 from urllib.error import HTTPError
 
-from utils import ARX_PDF_URL
+from utils import ARX_PDF_URL, LIT_MIRRORS
+import cache
+import metrics
+import mirrors
+from cache import conditional_headers
+from timing import Deadline, DeadlineExceeded
+
+DOWNLOAD_TIMEOUT = 30  # max seconds to wait on the connection or a read
+CHUNK_SIZE = 64 * 1024
 
 scrub_arx_id = lambda u: u.strip('htps:/warxiv.orgbdf').split('v')[0]
 
+def retrieve(url, fname, deadline=None, headers=None, opened=None):
+    """ download url to fname, recording latency and bytes downloaded
+
+    Like urlretrieve, but connection and reads time out after
+    DOWNLOAD_TIMEOUT (or the remaining deadline), and the deadline is
+    checked between chunks. The download goes to a .part file that only
+    replaces fname once complete, so a failure leaves fname as it was.
+
+    headers : dict
+        request headers, eg validators for a conditional request
+        (If-None-Match, If-Modified-Since)
+    opened : http.client.HTTPResponse
+        response already opened for url, to read the pdf from (see
+        retrieve_any)
+
+    Returns
+    -------
+    validators : dict | None
+        the response ETag and Last-Modified (those given), to make a
+        later request for url conditional; None if the server replied
+        304 Not Modified (fname is left untouched)
+    """
+    deadline = Deadline.of(deadline)
+    t0 = time.time()
+    num_bytes = 0
+    part = f"{fname}.part"
+    try:
+        resp = opened or _open(url, deadline, headers)
+        with resp, open(part, 'wb') as file:
+            while True:
+                deadline.check()
+                chunk = resp.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                file.write(chunk)
+                num_bytes += len(chunk)
+            validators = cache.validators_of(resp.headers)
+    except Exception as e:
+        status = e.code if isinstance(e, HTTPError) else None
+        metrics.observe_request(url, time.time() - t0, status, num_bytes, 'pdf')
+        if os.path.exists(part):
+            os.remove(part)
+        if status == 304:
+            return None
+        timed_out = isinstance(e, TimeoutError) or \
+                    isinstance(getattr(e, 'reason', None), TimeoutError)
+        if timed_out and deadline.expired and \
+           not isinstance(e, DeadlineExceeded):
+            raise DeadlineExceeded(f"deadline exceeded on {url}") from e
+        raise
+    os.replace(part, fname)
+    metrics.observe_request(url, time.time() - t0, 200, num_bytes, 'pdf')
+    return validators
+
+
+def _open(url, deadline, headers=None):
+    cache.check_online(url)
+    request = Request(url, headers=headers or {})
+    return urlopen(request, timeout=deadline.timeout(DOWNLOAD_TIMEOUT))
+
+_not_modified = lambda e: isinstance(e, HTTPError) and e.code == 304
+
+
+def retrieve_any(sources, fname, deadline=None, headers=None):
+    """ download fname from the best of equivalent sources, falling over
+    to the next ones if it fails (see mirrors.py)
+
+    sources : list
+        (source, url) pairs, eg from mirrors.Mirrors.sources_for
+
+    Returns validators, as retrieve.
+    """
+    deadline = Deadline.of(deadline)
+    table = mirrors.get_mirrors(LIT_MIRRORS)
+    ranked = table.rank(sources)
+    err = None
+    while ranked:
+        width = table.race_width(ranked)
+        contenders, ranked = ranked[:width], ranked[width:]
+        try:
+            source, url, resp, latency = _race(contenders, deadline, headers,
+                                               table)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            if _not_modified(e):
+                return None
+            err = e
+            continue
+        t0 = time.time()
+        try:
+            validators = retrieve(url, fname, deadline, headers, opened=resp)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            table.record(source, ok=False)
+            print(f"  {url} failed ({e})")
+            err = e
+            continue
+        rate = os.path.getsize(fname) / max(time.time() - t0, 1e-3)
+        table.record(source, ok=True, latency=latency, rate=rate)
+        return validators
+    raise err or ValueError('no pdf source')
+
+
+def _race(contenders, deadline, headers, table):
+    """ open connections to all contenders (source, url) at once; the
+    first to answer wins, and the others are closed as they answer
+
+    Returns (source, url, response, latency) of the winner.
+    """
+    def attempt(source, url):
+        t0 = time.time()
+        return source, url, _open(url, deadline, headers), time.time() - t0
+
+    def close_loser(future):
+        if future.cancelled():
+            return
+        e = future.exception()
+        if e is None:
+            source, _, resp, latency = future.result()
+            resp.close()
+            table.record(source, ok=True, latency=latency)
+        elif not (_not_modified(e) or isinstance(e, DeadlineExceeded)):
+            table.record(futures[future], ok=False)
+
+    if len(contenders) == 1:
+        try:
+            return attempt(*contenders[0])
+        except Exception as e:
+            if not (_not_modified(e) or isinstance(e, DeadlineExceeded)):
+                table.record(contenders[0][0], ok=False)
+            raise
+    pool = ThreadPoolExecutor(len(contenders))
+    futures = {pool.submit(attempt, *c): c[0] for c in contenders}
+    pool.shutdown(wait=False)
+    winner, err, seen = None, None, set()
+    try:
+        for future in as_completed(futures):
+            seen.add(future)
+            try:
+                winner = future.result()
+                break
+            except Exception as e:
+                if _not_modified(e) or isinstance(e, DeadlineExceeded):
+                    raise
+                table.record(futures[future], ok=False)
+                err = e
+    finally:
+        for other in futures:
+            if other not in seen: # (the winner, and failures, are seen)
+                other.add_done_callback(close_loser)
+    if winner is None:
+        raise err
+    return winner
+
+
 #-----------------------------------------------------------------------------#
 #                                     doi                                     #
 #-----------------------------------------------------------------------------#
@@ -86,24 +253,22 @@ class LibGen:
         self.navigate_to(doi, fname)
         self.generate_tree()
         self.get_pdf_url()
-        urlretrieve(self.pdf_url, self.pdf_file)
+        retrieve(self.pdf_url, self.pdf_file)
 
-def doi_download(doi, fname):
+def doi_download(doi, fname, deadline=None):
     """ dirty hack for libgen dls
     the mirrors change so frequently I think it might just be easier
     to change the hardcode
     """
-    #=== encode
-    base = "http://booksdl.org/scimag/get.php?"
-    doidict = dict(doi=doi)
-    doi_enc = urlencode(doidict)
-    dl_url = base + doi_enc #+ '&downloadname='
+    #=== sources: the hardcode is now mirrors.SOURCES['doi'], which can be
+    #    overridden in the mirrors config (LIT_MIRRORS)
+    sources = mirrors.get_mirrors(LIT_MIRRORS).sources_for(dict(DOI=doi))
 
     #=== retrieve
     try:
-        urlretrieve(dl_url, fname)
-    except HTTPError:
-        print(f"HTTPError on {dl_url}")
+        retrieve_any(sources, fname, deadline)
+    except HTTPError as e:
+        print(f"HTTPError on {e.url}")
 
 
 
@@ -121,33 +286,43 @@ def doi_download(doi, fname):
 #                                    arXiv                                    #
 #-----------------------------------------------------------------------------#
 
-def arx_download(url, fname=None):
+def arx_download(url, fname=None, deadline=None):
     # likely redundant strip,
     # but weakens preconditions on url to allow arx ids
     arx_id = scrub_arx_id(url)
     if fname is None:
         fname = arx_id + '.pdf'
     url = ARX_PDF_URL + arx_id
-    urlretrieve(url, fname)
+    sources = mirrors.get_mirrors(LIT_MIRRORS).sources_for(dict(pdf=url))
+    retrieve_any(sources, fname, deadline)
     print(f'  Downloaded {fname}')
 
 
 #-----------------------------------------------------------------------------#
 #                                    Main                                     #
 #-----------------------------------------------------------------------------#
-def download(pub_id, fname):
+@metrics.instrument('download')
+def download(pub_id, fname, deadline=None):
     sid = scrub_arx_id(pub_id)
     if len(sid.split('.')[0]) == 4:
         # arx ids always begin YYMM
-        arx_download(sid, fname)
+        arx_download(sid, fname, deadline)
     else:
-        doi_download(pub_id, fname)
+        doi_download(pub_id, fname, deadline)
 
-def download_from_response(info, fname):
+@metrics.instrument('download')
+def download_from_response(info, fname, deadline=None):
+    """ download the paper for processed info to fname,
+    within deadline (Deadline or seconds), if given;
+    returns the pdf's validators (see retrieve), if any
+    """
+    validators = None
     if 'pdf' in info:
-        urlretrieve(info.pdf, fname)
+        sources = mirrors.get_mirrors(LIT_MIRRORS).sources_for(info)
+        validators = retrieve_any(sources, fname, deadline)
     else:
         #libgen = LibGen()
         #libgen.download(info.DOI, fname)
-        doi_download(info.DOI, fname)
+        doi_download(info.DOI, fname, deadline)
     print(f'  Downloaded {fname}')
+    return validators
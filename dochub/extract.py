@@ -0,0 +1,166 @@
+"""
+Extraction of arXiv IDs and DOIs from arbitrary text.
+
+Reading lists, reference sections, HTML pages, .bib files and clipboard
+dumps are scanned with one compiled regex, chunk by chunk, and every
+arXiv ID (with its version, if given) and DOI is yielded once, in order
+of first appearance:
+
+    for kind, ref_id in extract.scan_file('reading-list.html'):
+        ...   # ('arxiv', '1706.03762v5'), ('doi', '10.1038/nature16961'), ...
+
+Recognized forms
+  * DOIs:  10.<registrant>/<suffix>, bare or in doi.org links; arXiv's own
+    DOIs (10.48550/arXiv.<id>) are returned as arXiv IDs
+  * new-style arXiv IDs:  YYMM.NNNN(N)[vN], bare, as arXiv:<id>, or in
+    arxiv.org/abs|pdf links
+  * old-style arXiv IDs:  <archive>[.XX]/YYMMNNN[vN], eg hep-th/9901001v2
+"""
+import re
+
+
+CHUNK_SIZE = 1 << 22  # chars read per chunk
+MAX_MATCH  = 512      # longest possible match; chunks overlap by this much
+
+_ARCHIVES = ("astro-ph|cond-mat|gr-qc|hep-ex|hep-lat|hep-ph|hep-th|math-ph|"
+             "nlin|nucl-ex|nucl-th|physics|quant-ph|math|cs|q-bio|q-fin|stat|"
+             "acc-phys|adap-org|alg-geom|ao-sci|atom-ph|bayes-an|chao-dyn|"
+             "chem-ph|cmp-lg|comp-gas|dg-ga|funct-an|mtrl-th|patt-sol|"
+             "plasm-ph|q-alg|solv-int|supr-con")
+
+# DOI suffixes: the characters CrossRef recommends matching on,
+# less trailing punctuation (trimmed afterwards)
+_DOI = r"10\.\d{4,9}/[-._;()/:A-Za-z0-9]{1,400}"
+_NEW = r"\d{4}\.\d{4,5}(?:v\d{1,3})?(?!\d)(?!\.\d)"
+_OLD = rf"(?:{_ARCHIVES})(?:\.[A-Z]{{2}})?/\d{{7}}(?:v\d{{1,3}})?(?!\d)"
+
+# Python's re only scans quickly for patterns starting with a literal, so
+# each kind of id is found from a literal anchor ('10.', '.NNNN', '/NNNNNNN')
+# and the rest is checked around the anchor; this is ~10x faster than one
+# alternation of the full patterns.
+DOI_RE = re.compile(_DOI)
+NEW_ANCHOR_RE = re.compile(r"\.\d{4,5}(?:v\d{1,3})?(?!\d)(?!\.\d)")
+OLD_ANCHOR_RE = re.compile(r"/\d{7}(?:v\d{1,3})?(?!\d)")
+ARCHIVE_RE = re.compile(rf"(?:^|(?<=[^\w.]))(?:{_ARCHIVES})(?:\.[A-Z]{{2}})?$")
+ARXIV_DOI_RE = re.compile(rf"10\.48550/arxiv\.(?P<id>{_NEW}|{_OLD})", re.I)
+VERSION_RE = re.compile(r"v\d+$")
+CONTEXT = 16  # chars before an anchor needed to check it (archive name)
+
+_boundary = lambda text, i: i == 0 or not (text[i-1].isalnum()
+                                           or text[i-1] in '._')
+
+
+def _trim_doi(doi):
+    """ drop trailing punctuation, and unbalanced closing parentheses """
+    doi = doi.rstrip('.,;:')
+    while doi.endswith(')') and doi.count(')') > doi.count('('):
+        doi = doi[:-1].rstrip('.,;:')
+    return doi
+
+
+def _candidates(text):
+    """ (start, end, kind, id) of possible ids in text, by start """
+    found = []
+    for m in DOI_RE.finditer(text):
+        if _boundary(text, m.start()):
+            doi = _trim_doi(m.group())
+            arx = ARXIV_DOI_RE.fullmatch(doi)
+            kind, ref_id = ('arxiv', arx.group('id')) if arx else ('doi', doi)
+            found.append((m.start(), m.end(), kind, ref_id))
+    for m in NEW_ANCHOR_RE.finditer(text):
+        start = m.start() - 4
+        yymm = text[start:m.start()]
+        if (start >= 0 and yymm.isdigit() and _boundary(text, start)
+                and 1 <= int(yymm[2:]) <= 12):
+            found.append((start, m.end(), 'arxiv', text[start:m.end()]))
+    for m in OLD_ANCHOR_RE.finditer(text):
+        arch = ARCHIVE_RE.search(text, max(0, m.start() - CONTEXT), m.start())
+        if arch:
+            found.append((arch.start(), m.end(), 'arxiv',
+                          text[arch.start():m.end()]))
+    found.sort()
+    return found
+
+
+def scan(chunks):
+    """ yield (kind, id) for each new id found in a stream of text chunks;
+    kind is 'arxiv' or 'doi'. IDs are deduplicated (DOIs case-insensitively,
+    arXiv IDs by id and version).
+    """
+    seen = set()
+    buf  = ''
+    base = 0    # offset of buf in the stream
+    done = 0    # stream offset up to which ids have been handled
+    chunks = iter(chunks)
+    chunk = next(chunks, None)
+    while chunk is not None:
+        buf += chunk
+        chunk = next(chunks, None)
+        final = chunk is None
+        found = _candidates(buf)
+        # ids ending near the end of buf may continue in the next chunk
+        cut = len(buf) if final else max(0, len(buf) - MAX_MATCH)
+        for start, end, _, _ in found:
+            if end > cut:
+                cut = min(cut, start)
+        for start, end, kind, ref_id in found:
+            if start >= cut:
+                break
+            if base + start < done:
+                continue # already handled, or inside a DOI
+            done = base + end
+            key = (kind, ref_id.lower())
+            if key not in seen:
+                seen.add(key)
+                yield kind, ref_id
+        # keep some context before the cut, to check anchors against
+        done = max(done, base + cut)
+        keep = max(0, cut - CONTEXT - 1)
+        buf, base = buf[keep:], base + keep
+
+
+def scan_text(text):
+    return scan(text[i:i + CHUNK_SIZE] for i in range(0, len(text), CHUNK_SIZE))
+
+
+def scan_file(path_or_file, chunk_size=CHUNK_SIZE):
+    """ scan a file (path, or open text file such as sys.stdin) """
+    def read(file):
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    if hasattr(path_or_file, 'read'):
+        yield from scan(read(path_or_file))
+        return
+    with open(path_or_file, encoding='utf-8', errors='replace') as file:
+        yield from scan(read(file))
+
+
+def extract_ids(text):
+    """ all ids in text, as plain strings """
+    return [ref_id for _, ref_id in scan_text(text)]
+
+
+def parse_id(text):
+    """ the first arXiv ID or DOI in text (eg, a link), or None
+
+    Returns
+    -------
+    kind : str | None
+        'arxiv' or 'doi'
+    ref_id : str | None
+    """
+    for found in scan_text(text.strip()):
+        return found
+    return None, None
+
+
+def strip_version(arx_id):
+    return VERSION_RE.sub('', arx_id)
+
+def version_of(arx_id):
+    """ version number of an arXiv ID (or link), None if it has none """
+    match = VERSION_RE.search(arx_id)
+    return int(match.group()[1:]) if match else None
@@ -0,0 +1,219 @@
+"""
+Faceted filtering of the library by year, venue, publisher, topic and author.
+
+Each facet is stored column-wise: a vocabulary of distinct values, and
+(paper row, value id) pairs. A filter clause is matched against the
+(small) vocabulary, then turned into a boolean mask over all papers with
+one vectorized `isin` over the pairs; clauses are combined with bitwise
+ops on the masks, so no record is ever scanned in Python.
+
+Filter syntax: clauses joined by AND / OR (AND binds tighter), each
+optionally preceded by NOT:
+
+    topic=Reinforcement Learning AND year>=2018 AND author~botvinick
+    venue~neurips OR venue~nips
+
+    field=value    exact match (case-insensitive)
+    field~value    substring match (case-insensitive)
+    field!=value   no value matches exactly
+    year<, <=, >, >=, =, != number
+"""
+import os
+import re
+
+import numpy as np
+
+
+FACETS = ['venue', 'publisher', 'topic', 'author']
+FIELDS = ['year'] + FACETS
+
+_clause_re = re.compile(r"^\s*(not\s+)?(\w+)\s*(<=|>=|!=|=|~|<|>)\s*(.+?)\s*$",
+                        re.IGNORECASE)
+
+
+def facet_values(info):
+    """ facet values of a processed paper (query.AttrDict) """
+    as_list = lambda v: [] if not v else [v] if isinstance(v, str) else list(v)
+    return dict(venue = as_list(info.get('venue')),
+                publisher = as_list(info.get('publisher')),
+                topic  = as_list(info.get('keywords')),
+                author = as_list(info.get('author')))
+
+
+class Facet:
+    """ one multi-valued facet: vocabulary + (row, value id) pairs """
+    def __init__(self, vocab=(), rows=(), values=()):
+        self.vocab = list(vocab)
+        self.ids   = {v: i for i, v in enumerate(self.vocab)}
+        self.rows   = np.asarray(rows, dtype=np.int32)
+        self.values = np.asarray(values, dtype=np.int32)
+        self._new = []  # unmerged (row, value id)
+        self._lower = None
+
+    def add(self, row, values):
+        for value in values:
+            vid = self.ids.get(value)
+            if vid is None:
+                vid = self.ids[value] = len(self.vocab)
+                self.vocab.append(value)
+                self._lower = None
+            self._new.append((row, vid))
+
+    def pairs(self):
+        if self._new:
+            new = np.array(self._new, dtype=np.int32)
+            self.rows   = np.concatenate([self.rows, new[:, 0]])
+            self.values = np.concatenate([self.values, new[:, 1]])
+            self._new = []
+        return self.rows, self.values
+
+    def match(self, op, value, n):
+        """ mask over n papers with a value matching (op, value) """
+        if self._lower is None:
+            self._lower = np.array([v.lower() for v in self.vocab] or [''])
+        value = value.lower()
+        if op == '~':
+            hits = np.char.find(self._lower, value) >= 0
+        else:
+            hits = self._lower == value
+        hits = np.flatnonzero(hits[:len(self.vocab)])
+        rows, values = self.pairs()
+        mask = np.zeros(n, dtype=bool)
+        mask[rows[np.isin(values, hits)]] = True
+        return ~mask if op == '!=' else mask
+
+
+class FacetIndex:
+    """ columnar facet store over the library, keyed by paper key """
+    def __init__(self):
+        self.keys   = []
+        self.titles = []
+        self._years = np.zeros(0, dtype=np.int16)
+        self._alive = np.zeros(0, dtype=bool) # False for superseded rows
+        self._new   = ([], [])  # unmerged years, alive
+        self.rows   = {}  # key : row
+        self.facets = {name: Facet() for name in FACETS}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _merge(self):
+        """ append the rows added since the last merge to the columns """
+        years, alive = self._new
+        if years:
+            self._years = np.concatenate(
+                [self._years, np.array(years, dtype=np.int16)])
+            self._alive = np.concatenate(
+                [self._alive, np.array(alive, dtype=bool)])
+            self._new = ([], [])
+
+    @property
+    def years(self):
+        self._merge()
+        return self._years
+
+    @property
+    def alive(self):
+        self._merge()
+        return self._alive
+
+    def add(self, key, info):
+        """ add (or replace) a paper's facets """
+        years, alive = self._new
+        old = self.rows.get(key)
+        if old is not None:
+            if old < len(self._alive):
+                self._alive[old] = False
+            else:
+                alive[old - len(self._alive)] = False
+        row = len(self.keys)
+        self.rows[key] = row
+        self.keys.append(key)
+        self.titles.append(info.get('title') or '')
+        year = str(info.get('year') or '0')[:4]
+        years.append(int(year) if year.isdigit() else 0)
+        alive.append(True)
+        for name, values in facet_values(info).items():
+            self.facets[name].add(row, values)
+
+    @classmethod
+    def rebuild(cls, records):
+        """ index from library records (key : info), see library.py """
+        index = cls()
+        for key, info in records.items():
+            index.add(key, info)
+        return index
+
+    #==== filtering
+    def clause(self, text):
+        """ mask of papers matching one clause, eg 'year>=2018' """
+        match = _clause_re.match(text)
+        if match is None:
+            raise ValueError(f"invalid filter clause: {text!r}")
+        negate, field, op, value = match.groups()
+        field = field.lower()
+        n = len(self.keys)
+        if field == 'year':
+            if op == '~' or not value.isdigit():
+                raise ValueError("year takes a number and <, <=, >, >=, =, !=")
+            y = int(value)
+            mask = {'<': self.years < y, '<=': self.years <= y,
+                    '>': self.years > y, '>=': self.years >= y,
+                    '=': self.years == y, '!=': self.years != y}[op]
+        elif field in self.facets:
+            if op not in ('=', '~', '!='):
+                raise ValueError(f"{field} takes =, ~ or !=")
+            mask = self.facets[field].match(op, value, n)
+        else:
+            raise ValueError(f"unknown field {field!r}; fields are {FIELDS}")
+        return ~mask if negate else mask
+
+    def filter(self, query):
+        """ mask of papers matching a filter query (see module doc) """
+        mask = np.zeros(len(self.keys), dtype=bool)
+        for disjunct in re.split(r"\s+or\s+", query, flags=re.IGNORECASE):
+            conj = np.ones(len(self.keys), dtype=bool)
+            for text in re.split(r"\s+and\s+", disjunct, flags=re.IGNORECASE):
+                conj &= self.clause(text)
+            mask |= conj
+        return mask & self.alive
+
+    def select(self, query=None):
+        """ (key, year, title) of matching papers, newest first """
+        mask = self.alive if not query else self.filter(query)
+        rows = np.flatnonzero(mask)
+        rows = rows[np.argsort(-self.years[rows], kind='stable')]
+        return [(self.keys[r], int(self.years[r]), self.titles[r]) for r in rows]
+
+    #==== persistence
+    def save(self, path):
+        arrays = dict(keys=np.array(self.keys, dtype=str),
+                      titles=np.array(self.titles, dtype=str),
+                      years=self.years, alive=self.alive)
+        for name, facet in self.facets.items():
+            rows, values = facet.pairs()
+            arrays[f"{name}_vocab"]  = np.array(facet.vocab, dtype=str)
+            arrays[f"{name}_rows"]   = rows
+            arrays[f"{name}_values"] = values
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = f"{path}.tmp.npz"
+        np.savez(tmp, **arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """ load index from path; empty index if path does not exist """
+        index = cls()
+        if not os.path.exists(path):
+            return index
+        data = np.load(path)
+        index.keys   = data['keys'].tolist()
+        index.titles = data['titles'].tolist()
+        index._years = data['years']
+        index._alive = data['alive']
+        index.rows = {k: i for i, k in enumerate(index.keys) if index._alive[i]}
+        for name in FACETS:
+            index.facets[name] = Facet(data[f"{name}_vocab"].tolist(),
+                                       data[f"{name}_rows"],
+                                       data[f"{name}_values"])
+        return index
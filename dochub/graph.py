@@ -0,0 +1,290 @@
+"""
+Local citation graph, built from Semantic Scholar responses.
+
+query_ss already downloads a paper's full `citations` and `references`
+lists; instead of keeping only a count, they are stored here, so questions
+like "which of my papers cite this one" or "what is two hops out from this
+paper" are array scans rather than API calls.
+
+Layout
+------
+Papers are interned to integer node ids (line number in nodes.tsv), keyed by
+SS paperId, with their DOI / arXiv ID as aliases. An edge u --> v means
+paper u cites paper v.
+
+    graph/
+      nodes.tsv       key, doi, arxivId, year, title  (append-only)
+      aliases.tsv     alias, node id                  (append-only)
+      library.txt     node ids of papers in the library (append-only)
+      edges.bin       int32 (src, dst) pairs          (append-only)
+      out_indptr.npy, out_indices.npy   CSR of edges.bin[:num_edges] by src
+      in_indptr.npy,  in_indices.npy    CSR of edges.bin[:num_edges] by dst
+      meta.json       {num_edges: edges covered by the CSR arrays}
+
+New edges are appended to edges.bin; the CSR arrays (memory-mapped) cover
+the compacted prefix, and the small uncompacted tail is scanned directly.
+The graph is recompacted once the tail grows past COMPACT_EVERY edges.
+"""
+import os
+import json
+
+import numpy as np
+
+from query import ref_key
+
+
+COMPACT_EVERY = 100_000 # uncompacted edges before recompacting
+
+
+class CitationGraph:
+    """ append-only citation graph with CSR adjacency
+
+    Params
+    ------
+    path : str
+        directory holding the graph files
+
+    mmap : bool
+        memory-map the CSR arrays rather than reading them in
+    """
+    def __init__(self, path, mmap=True):
+        self.path = path
+        self.mmap = mmap
+        self.keys    = []  # node id : key
+        self.nodes   = {}  # key | alias : node id
+        self.library = set()
+        self._new_nodes   = [] # unflushed rows for nodes.tsv
+        self._new_aliases = [] # unflushed (alias, node)
+        self._new_library = []
+        self._new_edges   = [] # unflushed (src, dst)
+        os.makedirs(path, exist_ok=True)
+        self.load()
+
+    _file = lambda self, name: os.path.join(self.path, name)
+
+    #==== loading
+    def load(self):
+        if os.path.exists(self._file('nodes.tsv')):
+            with open(self._file('nodes.tsv')) as file:
+                for line in file:
+                    key = line.split('\t', 1)[0]
+                    self.nodes[key] = len(self.keys)
+                    self.keys.append(key)
+        if os.path.exists(self._file('aliases.tsv')):
+            with open(self._file('aliases.tsv')) as file:
+                for line in file:
+                    alias, node = line.rstrip('\n').split('\t')
+                    self.nodes.setdefault(alias, int(node))
+        if os.path.exists(self._file('library.txt')):
+            with open(self._file('library.txt')) as file:
+                self.library = {int(n) for n in file.read().split()}
+        self._load_edges()
+
+    def _load_edges(self):
+        meta = {}
+        if os.path.exists(self._file('meta.json')):
+            with open(self._file('meta.json')) as file:
+                meta = json.load(file)
+        self.num_compacted = meta.get('num_edges', 0)
+        mode = 'r' if self.mmap else None
+        if self.num_compacted:
+            load = lambda name: np.load(self._file(name), mmap_mode=mode)
+            self.out_indptr  = load('out_indptr.npy')
+            self.out_indices = load('out_indices.npy')
+            self.in_indptr   = load('in_indptr.npy')
+            self.in_indices  = load('in_indices.npy')
+        else:
+            empty = np.zeros(1, dtype=np.int64)
+            self.out_indptr = self.in_indptr = empty
+            self.out_indices = self.in_indices = np.zeros(0, dtype=np.int32)
+        # uncompacted tail of the edge log
+        tail = np.zeros((0, 2), dtype=np.int32)
+        if os.path.exists(self._file('edges.bin')):
+            tail = np.fromfile(self._file('edges.bin'), dtype=np.int32,
+                               offset=self.num_compacted * 8).reshape(-1, 2)
+        self._tail = tail
+
+    #==== building
+    def intern(self, entry):
+        """ node id for an SS paper/citation/reference entry,
+        creating the node if it is new
+        """
+        aliases = [entry.get('paperId'), _doi_alias(entry.get('doi')),
+                   _arx_alias(entry.get('arxivId'))]
+        aliases = [a for a in aliases if a]
+        for alias in aliases:
+            if alias in self.nodes:
+                node = self.nodes[alias]
+                break
+        else:
+            key  = ref_key(entry)
+            node = self.nodes.get(key)
+            if node is None:
+                node = len(self.keys)
+                self.keys.append(key)
+                self.nodes[key] = node
+                row = [key, entry.get('doi'), entry.get('arxivId'),
+                       entry.get('year'), entry.get('title')]
+                row = ['' if v is None else str(v).replace('\t', ' ')
+                       .replace('\n', ' ') for v in row]
+                self._new_nodes.append('\t'.join(row))
+        for alias in aliases:
+            if alias not in self.nodes:
+                self.nodes[alias] = node
+                self._new_aliases.append((alias, node))
+        return node
+
+    def add_edges(self, src, dst):
+        """ add edges src[i] --> dst[i] (src cites dst) """
+        self._new_edges.extend(zip(src, dst))
+
+    def add_response(self, response, library=True):
+        """ add an SS paper response, with its references and citations
+
+        library : bool
+            mark the paper as being in the library
+        """
+        node = self.intern(response)
+        refs = [self.intern(r) for r in response.get('references') or []]
+        cits = [self.intern(c) for c in response.get('citations') or []]
+        self.add_edges([node] * len(refs), refs)
+        self.add_edges(cits, [node] * len(cits))
+        if library and node not in self.library:
+            self.library.add(node)
+            self._new_library.append(node)
+        return node
+
+    def flush(self):
+        """ append new nodes, aliases and edges to disk,
+        recompacting if the uncompacted tail has grown too long
+        """
+        self._write_pending()
+        if len(self._tail) >= COMPACT_EVERY:
+            self.compact()
+
+    def _write_pending(self):
+        if self._new_nodes:
+            with open(self._file('nodes.tsv'), 'a') as file:
+                file.write('\n'.join(self._new_nodes) + '\n')
+        if self._new_aliases:
+            with open(self._file('aliases.tsv'), 'a') as file:
+                file.writelines(f"{a}\t{n}\n" for a, n in self._new_aliases)
+        if self._new_library:
+            with open(self._file('library.txt'), 'a') as file:
+                file.writelines(f"{n}\n" for n in self._new_library)
+        if self._new_edges:
+            edges = np.array(self._new_edges, dtype=np.int32).reshape(-1, 2)
+            with open(self._file('edges.bin'), 'ab') as file:
+                edges.tofile(file)
+            self._tail = np.concatenate([self._tail, edges])
+        self._new_nodes, self._new_aliases = [], []
+        self._new_library, self._new_edges = [], []
+
+    def compact(self):
+        """ rebuild the CSR arrays from the full (deduplicated) edge log """
+        self._write_pending()
+        src, dst = self.edges()
+        num_nodes = len(self.keys)
+        uniq = np.unique(src.astype(np.int64) * num_nodes + dst)
+        src = (uniq // num_nodes).astype(np.int32)
+        dst = (uniq %  num_nodes).astype(np.int32)
+        # release the memory-maps before overwriting their files
+        self.out_indptr = self.out_indices = None
+        self.in_indptr  = self.in_indices  = None
+        for name, by, other in (('out', src, dst), ('in', dst, src)):
+            order  = np.argsort(by, kind='stable')
+            counts = np.bincount(by, minlength=num_nodes)
+            indptr = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+            np.save(self._file(f'{name}_indptr.npy'), indptr)
+            np.save(self._file(f'{name}_indices.npy'), other[order])
+        np.stack([src, dst], axis=1).tofile(self._file('edges.bin'))
+        with open(self._file('meta.json'), 'w') as file:
+            json.dump(dict(num_edges=len(src), num_nodes=num_nodes), file)
+        self._load_edges()
+
+    #==== queries
+    def node(self, ref):
+        """ node id for a paperId, DOI or arXiv ID (None if unknown) """
+        for alias in (ref, _doi_alias(ref), _arx_alias(ref)):
+            if alias in self.nodes:
+                return self.nodes[alias]
+        return None
+
+    def edges(self):
+        """ all edges (with possible duplicates) as (src, dst) arrays """
+        counts = np.diff(self.out_indptr)
+        src = np.repeat(np.arange(len(counts), dtype=np.int32), counts)
+        tail = self._tail
+        if self._new_edges:
+            new  = np.array(self._new_edges, dtype=np.int32).reshape(-1, 2)
+            tail = np.concatenate([tail, new])
+        src = np.concatenate([src, tail[:, 0]])
+        dst = np.concatenate([np.asarray(self.out_indices), tail[:, 1]])
+        return src, dst
+
+    def _neighbors(self, nodes, indptr, indices, col):
+        """ union of CSR rows for nodes, plus matches in the tail """
+        nodes = np.atleast_1d(np.asarray(nodes, dtype=np.int64))
+        rows  = nodes[nodes < len(indptr) - 1]
+        parts = [np.asarray(indices[indptr[n]:indptr[n+1]]) for n in rows]
+        tail  = self._tail
+        if self._new_edges:
+            new  = np.array(self._new_edges, dtype=np.int32).reshape(-1, 2)
+            tail = np.concatenate([tail, new])
+        hits = np.isin(tail[:, col], nodes)
+        parts.append(tail[hits, 1 - col])
+        return np.unique(np.concatenate(parts)).astype(np.int32)
+
+    def references(self, nodes):
+        """ nodes cited by any of nodes """
+        return self._neighbors(nodes, self.out_indptr, self.out_indices, 0)
+
+    def citations(self, nodes):
+        """ nodes citing any of nodes """
+        return self._neighbors(nodes, self.in_indptr, self.in_indices, 1)
+
+    def library_mask(self):
+        mask = np.zeros(len(self.keys), dtype=bool)
+        mask[list(self.library)] = True
+        return mask
+
+    def cited_by_library(self, ref):
+        """ library papers citing paper ref ("which of my papers cite this") """
+        node = self.node(ref)
+        if node is None:
+            return np.zeros(0, np.int32)
+        citing = self.citations(node)
+        return citing[self.library_mask()[citing]]
+
+    def two_hop(self, ref, direction='both'):
+        """ nodes exactly two hops from ref (excluding ref and its direct
+        neighbors); direction is 'out' (references), 'in' (citations) or 'both'
+        """
+        node = self.node(ref)
+        if node is None:
+            return np.zeros(0, np.int32)
+        hop = {'out': self.references, 'in': self.citations,
+               'both': lambda n: np.union1d(self.references(n),
+                                            self.citations(n))}[direction]
+        one = hop(node)
+        two = hop(one)
+        return np.setdiff1d(two, np.append(one, node))
+
+    def describe(self, node):
+        """ (key, year, title) for a node """
+        return self.keys[node], *self._node_rows().get(node, ('', ''))
+
+    def _node_rows(self):
+        if not hasattr(self, '_rows'):
+            self._rows = {}
+            path = self._file('nodes.tsv')
+            if os.path.exists(path):
+                with open(path) as file:
+                    for i, line in enumerate(file):
+                        _, _, _, year, title = line.rstrip('\n').split('\t')
+                        self._rows[i] = (year, title)
+        return self._rows
+
+
+_doi_alias = lambda doi: f"doi:{doi.lower()}" if doi else None
+_arx_alias = lambda arx: f"arXiv:{arx}" if arx else None
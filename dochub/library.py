@@ -0,0 +1,256 @@
+"""
+The library bibliography: one record of processed info per paper.
+
+Records are stored as JSON lines, appended to size-capped shards, with an
+offset index for single-record reads:
+
+    library/
+      shard-0000.jsonl   one JSON record per line (append-only)
+      shard-0001.jsonl   ...new shard once the last reaches SHARD_SIZE
+      index.tsv          key, shard, offset, length  (append-only)
+
+Adding or updating a paper appends one line to the last shard and one to
+the index; nothing is rewritten. When a paper is updated, the later
+record wins; once superseded records outnumber the rest, the shards are
+rewritten without them (see maybe_compact). Loading the whole library
+parses each shard with a single json.loads call, which is well over 10x
+faster than yaml.safe_load on the same records. The YAML bibliography (library.yml) is kept as an
+export, see `export_yaml`.
+"""
+import os
+import json
+import shutil
+
+
+SHARD_SIZE = 32 << 20  # bytes per shard before starting a new one
+SKIP_FIELDS = ['references', 'missing']  # kept elsewhere / per-query only
+COMPACT_RATIO = 2      # compact once there are this many records per paper
+COMPACT_MIN   = 1000   # ... and at least this many records
+
+
+class Library:
+    """ sharded JSON-lines store of paper records, keyed by paper key
+    (arXiv ID or DOI, see query.paper_key)
+    """
+    def __init__(self, path):
+        self.path = path
+        self.index = {}  # key : (shard, offset, length)
+        self.records = 0 # records in the shards, superseded ones included
+        _finish_compact(path)
+        os.makedirs(path, exist_ok=True)
+        self.shards = sorted(f for f in os.listdir(path)
+                             if f.startswith('shard-') and f.endswith('.jsonl'))
+        if os.path.exists(self._file('index.tsv')):
+            with open(self._file('index.tsv')) as file:
+                for line in file:
+                    key, shard, offset, length = line.rstrip('\n').split('\t')
+                    self.index[key] = (int(shard), int(offset), int(length))
+                    self.records += 1
+
+    _file = lambda self, name: os.path.join(self.path, name)
+    _shard = lambda self, i: self._file(f"shard-{i:04d}.jsonl")
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def keys(self):
+        return list(self.index)
+
+    #==== writing
+    def add(self, key, info):
+        """ append the record for key (replacing any earlier one) """
+        record = {k: v for k, v in info.items() if k not in SKIP_FIELDS}
+        record['key'] = key
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode()
+        shard = len(self.shards) - 1
+        if shard < 0 or os.path.getsize(self._shard(shard)) >= SHARD_SIZE:
+            shard += 1
+            self.shards.append(os.path.basename(self._shard(shard)))
+        with open(self._shard(shard), 'ab+') as file:
+            offset = file.tell()
+            if offset:
+                file.seek(offset - 1)
+                if file.read(1) != b'\n': # end a line cut short by a crash
+                    file.write(b'\n')
+                    offset += 1
+            file.write(line)
+        with open(self._file('index.tsv'), 'a') as file:
+            file.write(f"{key}\t{shard}\t{offset}\t{len(line)}\n")
+        self.index[key] = (shard, offset, len(line))
+        self.records += 1
+
+    #==== reading
+    def get(self, key):
+        """ record for key, None if not in the library """
+        if key not in self.index:
+            return None
+        shard, offset, length = self.index[key]
+        with open(self._shard(shard), 'rb') as file:
+            file.seek(offset)
+            return json.loads(file.read(length))
+
+    def load(self):
+        """ all records, as a dict key : record (in order first added) """
+        records = {}
+        for name in self.shards:
+            with open(self._file(name), encoding='utf-8') as file:
+                text = file.read().rstrip('\n')
+            if not text:
+                continue
+            try:
+                # one C-level parse per shard rather than one per line
+                shard = json.loads(f"[{text.replace(chr(10), ',')}]")
+            except ValueError:
+                # eg, a line cut short by a crash; keep the rest
+                shard = [json.loads(line) for line in text.split('\n')
+                         if _parses(line)]
+            for record in shard:
+                records[record['key']] = record
+        return records
+
+    def compact(self):
+        """ rewrite the shards without superseded records
+
+        The records are written to a new library next to this one, which is
+        then swapped in, so an interrupted compaction leaves the old
+        library in place (see _finish_compact).
+        """
+        records = self.load()
+        new_path = f"{self.path}.compact"
+        if os.path.exists(new_path):
+            shutil.rmtree(new_path) # left by an interrupted compaction
+        new = Library(new_path)
+        for key, record in records.items():
+            new.add(key, record)
+        os.replace(self.path, f"{self.path}.old")
+        os.replace(new_path, self.path)
+        shutil.rmtree(f"{self.path}.old")
+        self.shards, self.index, self.records = new.shards, new.index, new.records
+
+    def maybe_compact(self):
+        """ compact if superseded records have come to outnumber the
+        current ones (see COMPACT_RATIO); returns whether it did
+        """
+        if self.records < max(COMPACT_MIN, COMPACT_RATIO * len(self.index)):
+            return False
+        self.compact()
+        return True
+
+    #==== yaml
+    def export_yaml(self, path, jobs=1):
+        """ write the library as a YAML bibliography, one entry per paper
+        (identifier : fields), as library.yml used to be kept; entries are
+        serialized by `jobs` processes (see workers.py)
+        """
+        import yaml
+        import workers
+        entries = {}
+        for record in self.load().values():
+            fields = {k: v for k, v in record.items()
+                      if k not in ('key', 'identifier')}
+            entries[record.get('identifier') or record['key']] = fields
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w') as file:
+            if jobs == 1:
+                yaml.safe_dump(dict(entries=entries), file, allow_unicode=True,
+                               sort_keys=False)
+            else:
+                file.write('entries:\n' if entries else 'entries: {}\n')
+                file.writelines(workers.process_map(
+                    workers.yaml_dump, entries.items(), jobs))
+        os.replace(tmp, path)
+
+    def import_yaml(self, path, jobs=1):
+        """ add the entries of a YAML bibliography (see export_yaml; pybtex
+        yaml person lists are also read); returns the number added.
+        Entries are parsed by `jobs` processes (see workers.py)
+        """
+        import yaml
+        import workers
+        with open(path) as file:
+            text = file.read()
+        entries = split_entries(text) if jobs != 1 else None
+        if entries is not None:
+            pairs = workers.process_map(workers.yaml_load, entries, jobs)
+        else:
+            data = yaml.load(text, Loader=getattr(yaml, 'CSafeLoader',
+                                                  yaml.SafeLoader))
+            pairs = ((data or {}).get('entries') or {}).items()
+        count = 0
+        for identifier, fields in pairs:
+            info = dict(fields, identifier=identifier)
+            info.pop('type', None)
+            if isinstance(info.get('author'), list):
+                info['author'] = [_person(p) for p in info['author']]
+            key = info.get('arxivId') or info.get('DOI') or info.get('doi')
+            if key:
+                self.add(str(key), info)
+                count += 1
+        return count
+
+    #==== bibtex
+    def export_bib(self, path, jobs=1):
+        """ write the library as a bibtex file (see documents.make_bib_entry);
+        entries are rendered by `jobs` processes (see workers.py)
+        """
+        import workers
+        records = [dict(r, identifier=r.get('identifier') or r['key'])
+                   for r in self.load().values()]
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w') as file:
+            file.write('\n'.join(workers.process_map(
+                workers.bib_entries, records, jobs)))
+        os.replace(tmp, path)
+
+
+def _finish_compact(path):
+    """ recover from a compaction interrupted while swapping libraries:
+    put the old library back if the new one was not yet in place, and
+    remove it if it was
+    """
+    old = f"{path}.old"
+    if not os.path.exists(old):
+        return
+    if os.path.exists(path):
+        shutil.rmtree(old)
+    else:
+        os.replace(old, path)
+
+
+def split_entries(text):
+    """ the texts of the entries of a YAML bibliography (the items of its
+    top-level 'entries:' block mapping, indented by 2), or None if it is
+    not laid out that way
+    """
+    lines = text.splitlines(keepends=True)
+    starts = [i for i, line in enumerate(lines) if line.rstrip() == 'entries:']
+    if len(starts) != 1:
+        return None
+    entries = []
+    for line in lines[starts[0] + 1:]:
+        if line[:1] not in (' ', '\n', '#'):
+            break # next top-level key
+        if line.startswith('  ') and line[2:3] not in (' ', '-', '\n', ''):
+            entries.append(line)
+        elif entries:
+            entries[-1] += line
+        elif line.strip() and not line.lstrip().startswith('#'):
+            return None
+    return entries
+
+
+def _parses(line):
+    try:
+        json.loads(line)
+        return True
+    except ValueError:
+        return False
+
+def _person(person):
+    if isinstance(person, str):
+        return person
+    parts = ('first', 'middle', 'prelast', 'last', 'lineage')
+    return ' '.join(person[p] for p in parts if person.get(p))
@@ -0,0 +1,254 @@
+"""
+Opt-in memory instrumentation for long batch and import runs.
+
+Uses tracemalloc to watch the query pipeline:
+    query_ss --> process_ss --> make_bib_entry
+
+For each record, the traced memory peak within each stage is measured
+relative to where the stage started (the "peak delta"), and snapshots taken
+between stages are diffed to find the allocation sites that grew the most.
+Whatever is still allocated at the end of the run (relative to when profiling
+started) is reported as retained; that is where lingering AttrDict records and
+raw SS json show up.
+
+Usage
+-----
+    import memprof
+    memprof.enable('memprof.txt', top_n=15)
+    with memprof.record(ref_id):
+        with memprof.stage('query_ss'):
+            ...
+    memprof.report()  # also called at exit
+
+When not enabled, `record` and `stage` are no-ops, so the hooks can stay in
+the pipeline for free.
+"""
+import os
+import time
+import atexit
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from collections import OrderedDict
+
+
+#-----------------------------------------------------------------------------#
+#                                  Profiler                                   #
+#-----------------------------------------------------------------------------#
+
+class StageStats:
+    """ running stats for a single pipeline stage """
+    def __init__(self):
+        self.calls = 0
+        self.peak_total = 0  # sum of per-call peak deltas
+        self.peak_max   = 0
+        self.net_total  = 0  # sum of per-call (end - start)
+        self.max_record = None
+
+    def update(self, ref_id, peak_delta, net_delta):
+        self.calls += 1
+        self.peak_total += peak_delta
+        self.net_total  += net_delta
+        if peak_delta >= self.peak_max:
+            self.peak_max = peak_delta
+            self.max_record = ref_id
+
+
+class MemProfiler:
+    """ tracemalloc wrapper tracking stage and record memory deltas
+
+    Params
+    ------
+    report_path : str
+        file the report is written to
+
+    top_n : int
+        number of allocation sites to list in each section of report
+
+    frames : int
+        traceback depth stored per allocation (tracemalloc nframe);
+        more frames is more informative, but slower
+
+    snapshot_every : int
+        only snapshot between stages for every nth record;
+        snapshots are costly on big runs (and inflate the measured peaks
+        a little); peaks are always tracked
+    """
+    def __init__(self, report_path, top_n=10, frames=1, snapshot_every=1):
+        self.report_path = report_path
+        self.top_n  = top_n
+        self.frames = frames
+        self.snapshot_every = max(1, snapshot_every)
+        self.stages   = OrderedDict()  # name : StageStats
+        self.records  = []             # (ref_id, peak_delta, net_delta)
+        self.site_growth = {}          # (stage, site) : size_diff
+        self._baseline = None
+        self._record_id = None
+        self._record_peak = 0  # absolute peak seen so far in current record
+        self._num_records = 0
+        self._t_start = None
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        self._baseline = _snapshot()
+        self._t_start = time.time()
+
+    @property
+    def _snapshotting(self):
+        return self._num_records % self.snapshot_every == 0
+
+    @contextmanager
+    def record(self, ref_id):
+        """ track the peak memory delta for processing one record """
+        self._record_id = ref_id
+        tracemalloc.reset_peak()
+        start, _ = tracemalloc.get_traced_memory()
+        self._record_peak = start
+        try:
+            yield
+        finally:
+            end, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, self._record_peak)
+            self.records.append((ref_id, peak - start, end - start))
+            self._record_id = None
+            self._num_records += 1
+
+    @contextmanager
+    def stage(self, name):
+        """ track peak delta within a stage, and diff snapshots across it """
+        snap = self._snapshotting
+        before = _snapshot() if snap else None
+        # stages are nested within a record; keep the record peak before
+        # resetting for this stage so it isn't lost
+        start, rec_peak = tracemalloc.get_traced_memory()
+        self._record_peak = max(self._record_peak, rec_peak)
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            end, peak = tracemalloc.get_traced_memory()
+            self._record_peak = max(self._record_peak, peak)
+            stats = self.stages.setdefault(name, StageStats())
+            stats.update(self._record_id, peak - start, end - start)
+            if snap:
+                after = _snapshot()
+                self._accumulate_growth(name, after.compare_to(before, 'lineno'))
+
+    def _accumulate_growth(self, stage, diffs):
+        for stat in diffs:
+            if stat.size_diff <= 0:
+                continue
+            site = str(stat.traceback)
+            key  = (stage, site)
+            self.site_growth[key] = self.site_growth.get(key, 0) + stat.size_diff
+
+    #==== report
+    def report(self):
+        """ write the profiling report to self.report_path """
+        if self._baseline is None:
+            return
+        current, _ = tracemalloc.get_traced_memory()
+        final = _snapshot()
+        retained = final.compare_to(self._baseline, 'lineno')
+        elapsed = time.time() - self._t_start
+        n = self.top_n
+
+        lines = []
+        wr = lines.append
+        wr("dochub memory profile")
+        wr("=====================")
+        wr(f"records: {len(self.records)}    elapsed: {elapsed:.1f}s    "
+           f"traced now: {_fmt(current)}")
+        wr('')
+
+        #==== stages
+        wr("Stages")
+        wr("------")
+        wr(f"{'stage':<16} {'calls':>7} {'mean peak':>11} {'max peak':>11} "
+           f"{'mean net':>11}  max record")
+        for name, s in self.stages.items():
+            calls = max(1, s.calls)
+            wr(f"{name:<16} {s.calls:>7} {_fmt(s.peak_total / calls):>11} "
+               f"{_fmt(s.peak_max):>11} {_fmt(s.net_total / calls):>11}  "
+               f"{s.max_record}")
+        wr('')
+
+        #==== records
+        wr(f"Top {n} records by peak delta")
+        wr("-----------------------------")
+        by_peak = sorted(self.records, key=lambda r: r[1], reverse=True)
+        for ref_id, peak, net in by_peak[:n]:
+            wr(f"{_fmt(peak):>11} peak  {_fmt(net):>11} net  {ref_id}")
+        wr('')
+
+        #==== allocation sites
+        wr(f"Top {n} growing allocation sites per stage")
+        wr("-----------------------------------------")
+        for name in self.stages:
+            sites = [(site, size) for (stage, site), size
+                     in self.site_growth.items() if stage == name]
+            sites.sort(key=lambda s: s[1], reverse=True)
+            wr(f"[{name}]")
+            for site, size in sites[:n]:
+                wr(f"  {_fmt(size):>11}  {site}")
+        wr('')
+
+        wr(f"Top {n} retained allocation sites (vs start of run)")
+        wr("--------------------------------------------------")
+        for stat in retained[:n]:
+            wr(f"  {_fmt(stat.size_diff):>11}  {stat.count_diff:>8} blocks  "
+               f"{stat.traceback}")
+
+        dirname = os.path.dirname(os.path.abspath(self.report_path))
+        os.makedirs(dirname, exist_ok=True)
+        with open(self.report_path, 'w') as file:
+            file.write('\n'.join(lines) + '\n')
+        print(f"  memory profile written to {self.report_path}")
+
+
+def _snapshot():
+    """ snapshot of traced memory, ignoring the profiler's own allocations """
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__),
+              tracemalloc.Filter(False, __file__)]
+    return tracemalloc.take_snapshot().filter_traces(ignore)
+
+def _fmt(num_bytes):
+    """ human readable byte size, eg 2.3 MiB """
+    size = float(num_bytes)
+    for unit in ['B', 'KiB', 'MiB']:
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+
+#-----------------------------------------------------------------------------#
+#                                  Interface                                  #
+#-----------------------------------------------------------------------------#
+_profiler = None
+
+def enable(report_path, top_n=10, frames=1, snapshot_every=1):
+    """ start memory profiling; report is written at exit """
+    global _profiler
+    if _profiler is None:
+        _profiler = MemProfiler(report_path, top_n, frames, snapshot_every)
+        _profiler.start()
+        atexit.register(report)
+    return _profiler
+
+def enabled():
+    return _profiler is not None
+
+def record(ref_id):
+    if _profiler is None:
+        return nullcontext()
+    return _profiler.record(ref_id)
+
+def stage(name):
+    if _profiler is None:
+        return nullcontext()
+    return _profiler.stage(name)
+
+def report():
+    if _profiler is not None:
+        _profiler.report()
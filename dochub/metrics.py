@@ -0,0 +1,245 @@
+"""
+Run metrics for scheduled (cron) dochub runs.
+
+Metrics are kept in-process and written out in the Prometheus text exposition
+format, to be picked up by node_exporter's textfile collector:
+    node_exporter --collector.textfile.directory=/var/lib/node_exporter
+
+The textfile is written at exit, and optionally refreshed during a run
+(at most every `interval` seconds) so long syncs can be watched while they go.
+
+Metrics
+-------
+dochub_papers_processed_total{source}      papers processed (ss, crossref, arxiv)
+dochub_cache_requests_total{cache,result}  cache lookups (result=hit|miss)
+dochub_requests_coalesced_total{kind}      lookups that waited on an identical one
+dochub_http_requests_total{host,code}      upstream requests by status code
+dochub_http_request_duration_seconds{host} upstream request latency histogram
+dochub_http_retries_total{host}            requests retried
+dochub_http_throttled_total{host}          429 (Too Many Requests) responses
+dochub_bytes_downloaded_total{kind}        bytes received (api | pdf)
+dochub_failures_total{stage,type}          exceptions by stage and type
+dochub_run_start_timestamp_seconds         when the run started
+dochub_run_duration_seconds                time since the run started
+"""
+import os
+import time
+import atexit
+import functools
+import threading
+from urllib.parse import urlparse
+
+
+#-----------------------------------------------------------------------------#
+#                                Metric types                                 #
+#-----------------------------------------------------------------------------#
+_lock = threading.Lock()
+
+def _fmt_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    esc = lambda v: str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+    return '{' + ','.join(f'{k}="{esc(v)}"' for k, v in pairs) + '}'
+
+
+class Metric:
+    kind = None
+    def __init__(self, name, doc, labels=()):
+        self.name = name
+        self.doc  = doc
+        self.labels = tuple(labels)
+        self.values = {}  # label values tuple : value
+
+    def _key(self, labels):
+        return tuple(str(labels.get(l, '')) for l in self.labels)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = 'counter'
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(self._key(labels), 0)
+
+    def lines(self):
+        out = self.header()
+        for key, val in sorted(self.values.items()):
+            out.append(f"{self.name}{_fmt_labels(self.labels, key)} {val}")
+        return out
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+    def set(self, value, **labels):
+        with _lock:
+            self.values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+    # seconds; api calls are usually sub-second, pdf downloads are not
+    BUCKETS = (.05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name, doc, labels=(), buckets=BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            if key not in self.values:
+                self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts, _, _ = hist = self.values[key]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            hist[1] += value
+            hist[2] += 1
+
+    def lines(self):
+        out = self.header()
+        for key, (counts, total, num) in sorted(self.values.items()):
+            for bound, count in zip(self.buckets, counts):
+                lbl = _fmt_labels(self.labels, key, [('le', bound)])
+                out.append(f"{self.name}_bucket{lbl} {count}")
+            lbl = _fmt_labels(self.labels, key, [('le', '+Inf')])
+            out.append(f"{self.name}_bucket{lbl} {num}")
+            lbl = _fmt_labels(self.labels, key)
+            out.append(f"{self.name}_sum{lbl} {total:.6f}")
+            out.append(f"{self.name}_count{lbl} {num}")
+        return out
+
+
+#-----------------------------------------------------------------------------#
+#                                  Registry                                   #
+#-----------------------------------------------------------------------------#
+papers_processed = Counter('dochub_papers_processed_total',
+    'Papers processed, by metadata source.', ['source'])
+cache_requests = Counter('dochub_cache_requests_total',
+    'Cache lookups, by cache and result (hit|miss).', ['cache', 'result'])
+requests_coalesced = Counter('dochub_requests_coalesced_total',
+    'Lookups served by an identical lookup in flight, by kind.', ['kind'])
+http_requests = Counter('dochub_http_requests_total',
+    'Upstream HTTP requests, by host and status code.', ['host', 'code'])
+http_latency = Histogram('dochub_http_request_duration_seconds',
+    'Upstream HTTP request latency, by host.', ['host'])
+http_retries = Counter('dochub_http_retries_total',
+    'Upstream HTTP requests retried, by host.', ['host'])
+http_throttled = Counter('dochub_http_throttled_total',
+    'HTTP 429 (Too Many Requests) responses, by host.', ['host'])
+bytes_downloaded = Counter('dochub_bytes_downloaded_total',
+    'Bytes received, by kind (api|pdf).', ['kind'])
+failures = Counter('dochub_failures_total',
+    'Exceptions raised, by pipeline stage and exception type.', ['stage', 'type'])
+run_start = Gauge('dochub_run_start_timestamp_seconds',
+    'Unix time the run started.')
+run_duration = Gauge('dochub_run_duration_seconds',
+    'Seconds elapsed since the run started.')
+
+REGISTRY = [papers_processed, cache_requests, requests_coalesced,
+            http_requests, http_latency, http_retries, http_throttled,
+            bytes_downloaded, failures, run_start, run_duration]
+
+_T0 = time.time()
+run_start.set(_T0)
+
+
+#-----------------------------------------------------------------------------#
+#                                Instrumenting                                #
+#-----------------------------------------------------------------------------#
+host_of = lambda url: urlparse(url).netloc or 'unknown'
+
+def observe_request(url, seconds, status=None, num_bytes=0, kind='api'):
+    """ record a single upstream request """
+    host = host_of(url)
+    http_latency.observe(seconds, host=host)
+    http_requests.inc(host=host, code=status if status is not None else 'error')
+    if status == 429:
+        http_throttled.inc(host=host)
+    if num_bytes:
+        bytes_downloaded.inc(num_bytes, kind=kind)
+
+def cache_lookup(cache, hit):
+    cache_requests.inc(cache=cache, result='hit' if hit else 'miss')
+
+def instrument(stage):
+    """ decorator counting exceptions raised by `stage` by type
+    (exceptions are re-raised), and flushing the textfile after each call
+
+    An exception raised `from` another is counted by the type of its cause,
+    so wrappers like query's "Query unsuccessful" keep the breakdown.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                failures.inc(stage=stage, type=type(e.__cause__ or e).__name__)
+                raise
+            finally:
+                maybe_flush()
+        return wrapper
+    return decorator
+
+
+#-----------------------------------------------------------------------------#
+#                                  Textfile                                   #
+#-----------------------------------------------------------------------------#
+_textfile = None
+_interval = None
+_last_flush = 0.0
+
+def render():
+    """ all metrics in prometheus text format """
+    run_duration.set(round(time.time() - _T0, 3))
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.lines())
+    return '\n'.join(lines) + '\n'
+
+def write_textfile(path):
+    """ atomically write metrics to path
+    (the textfile collector may read the file at any moment, so write
+    to a temp file in the same dir and rename over the old one)
+    """
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w') as file:
+        file.write(render())
+    os.replace(tmp, path)
+
+def configure(path, interval=None):
+    """ enable the textfile exporter
+
+    Params
+    ------
+    path : str
+        textfile path, eg /var/lib/node_exporter/dochub.prom
+
+    interval : float | None
+        if set, also rewrite the textfile during the run, at most
+        every `interval` seconds
+    """
+    global _textfile, _interval
+    if _textfile is None:
+        atexit.register(flush)
+    _textfile = path
+    _interval = interval
+
+def maybe_flush():
+    if _textfile is not None and _interval is not None:
+        if time.time() - _last_flush >= _interval:
+            flush()
+
+def flush():
+    global _last_flush
+    if _textfile is not None:
+        _last_flush = time.time()
+        write_textfile(_textfile)
@@ -0,0 +1,164 @@
+"""
+Latency-aware choice between equivalent pdf sources.
+
+The same pdf can often be had from several places: arxiv.org and
+export.arxiv.org, institutional mirrors, or one of the (frequently moving)
+DOI pdf hosts. Sources are listed per kind in a JSON config, as url
+templates ({id}: arXiv ID, {doi}: url-encoded DOI):
+
+    mirrors.json (Literature dir)
+      {"arxiv": ["https://arxiv.org/pdf/{id}", "https://export.arxiv.org/pdf/{id}"],
+       "doi":   ["http://booksdl.org/scimag/get.php?doi={doi}"]}
+
+For each source (template), rolling averages of its latency (time to
+response headers), throughput and failure rate are kept, and persisted
+between runs. Downloads try sources in order of expected download time;
+when the best two are close, or either is still little known, their
+connections are raced and the first to answer is used (see
+downloader.retrieve_any). A source that starts failing or slowing down
+drops back in the order by itself, and is retried now and then.
+
+    mirror_scores.json (.cache)
+      {source: {latency, rate, fail, samples, last}}
+
+A source is a configured template, or, for pdf links found in the paper
+info (eg SS open-access links), the scheme and host of the link, so
+scores stay one per site rather than one per pdf.
+"""
+import os
+import json
+import time
+import atexit
+import threading
+from urllib.parse import quote, urlparse
+
+from routing import CACHE_DIR
+
+
+#-----------------------------------------------------------------------------#
+#                                  Constants                                  #
+#-----------------------------------------------------------------------------#
+SCORES_FILE = f"{CACHE_DIR}/mirror_scores.json"
+SOURCES = {
+    'arxiv': ['https://arxiv.org/pdf/{id}', 'https://export.arxiv.org/pdf/{id}'],
+    'doi':   ['http://booksdl.org/scimag/get.php?doi={doi}'],
+}
+ALPHA = 0.3            # weight of the newest sample in the rolling averages
+PDF_SIZE = 2 << 20     # bytes; typical pdf, to turn throughput into time
+MIN_SAMPLES = 3        # downloads before a source's averages are trusted
+RACE_MARGIN = 1.5      # race the best two if within this factor of each other
+FAIL_COST = 2.0        # seconds lost to a failed try, beyond its latency
+RETRY_AFTER = 3600     # seconds before an unused source is tried again
+
+_arxiv_hosts = ('arxiv.org', 'export.arxiv.org', 'www.arxiv.org')
+
+
+class Mirrors:
+    """ pdf source config and per-source scores """
+    def __init__(self, config=None, path=SCORES_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.sources = dict(SOURCES)
+        if config and os.path.exists(config):
+            with open(config) as file:
+                self.sources.update(json.load(file))
+        self.scores = {}
+        if os.path.exists(path):
+            with open(path) as file:
+                scores = json.load(file)
+            # (dropping any per-pdf scores kept by earlier versions)
+            known = {t for templates in self.sources.values() for t in templates}
+            self.scores = {k: v for k, v in scores.items()
+                           if k in known or urlparse(k).path in ('', '/')}
+        self._dirty = False
+
+    def save(self):
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, 'w') as file:
+                json.dump(self.scores, file, indent=1)
+            os.replace(tmp, self.path)
+            self._dirty = False
+
+    #==== sources
+    def sources_for(self, info):
+        """ (source, url) for each source of the pdf of processed info:
+        every configured arXiv source for arXiv pdfs, the configured DOI
+        sources when there is no pdf link, else the pdf link itself (as a
+        source named by its host)
+        """
+        pdf = info.get('pdf')
+        if pdf and urlparse(pdf).hostname in _arxiv_hosts:
+            arx_id = pdf.rstrip('/').split('/pdf/')[-1]
+            if arx_id.endswith('.pdf'):
+                arx_id = arx_id[:-4]
+            return [(t, t.format(id=arx_id)) for t in self.sources['arxiv']]
+        if pdf:
+            url = urlparse(pdf)
+            return [(f"{url.scheme}://{url.netloc}", pdf)]
+        doi = quote(info['DOI'], safe='')
+        return [(t, t.format(doi=doi)) for t in self.sources['doi']]
+
+    #==== scores
+    def expected_time(self, source):
+        """ expected seconds to download a typical pdf from source;
+        0 for sources with too few samples (and no failures), or unused for
+        RETRY_AFTER, so they get tried
+        """
+        score = self.scores.get(source)
+        if score is None or (score['samples'] < MIN_SAMPLES
+                             and not score['fail']):
+            return 0.0
+        if time.time() - score['last'] > RETRY_AFTER:
+            return 0.0 # not tried for a while; may have recovered
+        seconds = score['latency'] # (+ transfer time, once measured)
+        seconds += PDF_SIZE / score['rate'] if score['rate'] else 0.0
+        # plus the expected failed tries before one succeeds
+        fail = min(score['fail'], 0.95)
+        return seconds + fail / (1 - fail) * (score['latency'] + FAIL_COST)
+
+    def rank(self, sources):
+        """ sources (source, url) best first (stable for ties) """
+        return sorted(sources, key=lambda s: self.expected_time(s[0]))
+
+    def race_width(self, ranked):
+        """ how many of the ranked sources to race: 2 if the best two are
+        close (or little known), else 1
+        """
+        if len(ranked) < 2:
+            return len(ranked)
+        best, second = (self.expected_time(s) for s, _ in ranked[:2])
+        return 2 if second <= best * RACE_MARGIN else 1
+
+    def record(self, source, ok, latency=None, rate=None):
+        """ record a request to source: whether it succeeded, its latency
+        (seconds to response headers) and throughput (bytes per second)
+        """
+        with self.lock:
+            score = self.scores.setdefault(source, dict(
+                latency=latency or 0.0, rate=rate or 0.0, fail=0.0,
+                samples=0, last=0.0))
+            mix = lambda old, new: new if not score['samples'] \
+                                   else (1 - ALPHA) * old + ALPHA * new
+            if latency is not None:
+                score['latency'] = mix(score['latency'], latency)
+            if rate is not None:
+                score['rate'] = mix(score['rate'], rate)
+            score['fail'] = mix(score['fail'], 0.0 if ok else 1.0)
+            score['samples'] += 1
+            score['last'] = time.time()
+            self._dirty = True
+
+
+#-----------------------------------------------------------------------------#
+#                                  Interface                                  #
+#-----------------------------------------------------------------------------#
+_mirrors = None
+
+def get_mirrors(config=None):
+    global _mirrors
+    if _mirrors is None:
+        _mirrors = Mirrors(config)
+        atexit.register(lambda: _mirrors._dirty and _mirrors.save())
+    return _mirrors
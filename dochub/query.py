@@ -15,14 +15,12 @@ arXiv
 + fast (feedparser)
 + includes article abstract
 + always has link to pdf
-+ supports queries for many paper IDs*
-+ supports general search queries*
++ supports queries for many paper IDs
++ supports general search queries
 - only supports articles published to arxiv
 - somewhat redundant data fields in response
 - very little information about an article beyond big bois (year, title, auth, etc.)
 
-* Not (yet) supported in this module
-
 Semantic Scholar
 ----------------
 + new hotness
@@ -68,13 +66,28 @@ queries are supported (multiple ids from input or file to be supported later).
 """
 import sys
 import code
+import json
+import time
+import functools
 import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlencode
 from typing import List, Set, Dict, Tuple, Optional
 
 import requests
 from unidecode import unidecode
 from slugify import slugify
 
+import authors
+import cache
+import memprof
+import metrics
+import routing
+import similarity
+import snapshot
+from extract import parse_id, strip_version, version_of
+from timing import Deadline, DeadlineExceeded
+
 
 #-----------------------------------------------------------------------------#
 #                               Query constants                               #
@@ -83,8 +96,38 @@ from slugify import slugify
 # ====
 doi_url = "http://doi.org/"
 ss_api_paper_url = "https://api.semanticscholar.org/v1/paper/"
+ss_graph_paper_url = "https://api.semanticscholar.org/graph/v1/paper/"
 crossref_api_url = "http://api.crossref.org/works/"
-arxiv_api_paper_url = "http://export.arxiv.org/api/query?id_list="
+arxiv_api_url = "http://export.arxiv.org/api/query"
+arxiv_api_paper_url = arxiv_api_url + "?id_list="
+
+# http
+# ====
+HTTP_RETRIES = 2        # retries on 429 / 5xx
+HTTP_RETRY_WAIT = 30    # max seconds to wait between retries
+HTTP_TIMEOUT = 10       # max seconds per request, when no deadline is tighter
+ENRICH_MIN_TIME = 1.0   # budget needed to try optional enrichments
+ARXIV_BATCH = 100       # ids per arxiv api request
+CROSSREF_BATCH = 50     # DOIs per crossref filter request (url length)
+ARXIV_PAGE  = 100       # results per arxiv search request
+ARXIV_WAIT  = 3         # seconds between arxiv api requests (their terms)
+
+# crossref
+# ========
+# the only fields process_crossref reads; asking for just these (select=)
+# leaves out reference lists, licenses, funders, etc
+CROSSREF_FIELDS = ['DOI', 'URL', 'title', 'created', 'author',
+                   'is-referenced-by-count', 'container-title', 'publisher']
+
+# hedged queries
+# ==============
+HEDGE = False           # query SS and CrossRef concurrently for DOIs
+HEDGE_DEADLINE = 2.0    # seconds (from start) to wait for both to merge
+HEDGE_FIELDS = ['title', 'author', 'year', 'DOI', 'URL'] # "complete" record
+
+# callbacks called with each raw SS paper response, eg, to keep its
+# citations and references in the local citation graph (see graph.py)
+ss_response_hooks = []
 
 class AttrDict(dict):
     """ dict that has dot access (cannot pickle) """
@@ -97,10 +140,29 @@ class AttrDict(dict):
 #-----------------------------------------------------------------------------#
 # String stuff
 # ============
-is_doi   = lambda ref_id: ref_id[2] == '.'
-scrub_id = lambda u: u.strip('htps:/warxiv.orgbdf').split('v')[0]
+is_doi   = lambda ref_id: ref_id.strip().startswith('10.')
+is_ss_id = lambda ref_id: len(ref_id) == 40 and \
+                          all(c in '0123456789abcdef' for c in ref_id)
 to_ascii = lambda s: unidecode(s) # to_ascii('çivicioglu') --> 'civicioglu'
 
+def scrub_id(u):
+    """ bare arXiv ID, without version, from an ID or arxiv link
+    eg 'https://arxiv.org/pdf/1704.02532v2.pdf' --> '1704.02532',
+       'arXiv:hep-th/9901001v1' --> 'hep-th/9901001'
+    (anything else, eg an SS paperId, is returned stripped)
+    """
+    kind, ref_id = parse_id(u)
+    return strip_version(ref_id) if kind == 'arxiv' else u.strip()
+
+def normalize_id(text):
+    """ the paper id in text (an ID, or a doi.org / arxiv link) as taken by
+    query: a DOI, a bare arXiv ID, or (if neither is found) text stripped
+    """
+    kind, ref_id = parse_id(text)
+    if kind == 'arxiv':
+        return strip_version(ref_id)
+    return ref_id or text.strip()
+
 # arxiv urls
 arxiv_abs = lambda arx_id: f"https://arxiv.org/abs/{arx_id}"
 arxiv_pdf = lambda arx_id: f"https://arxiv.org/pdf/{arx_id}"
@@ -110,11 +172,99 @@ ss_pdf = lambda pid: f'https://pdfs.semanticscholar.org/{pid[:4]}/{pid[4:]}.pdf'
 
 # Parse helpers
 # =============
+class NotFound(LookupError):
+    """ no backend has the paper """
+
+def is_not_found(error):
+    """ whether error means the paper is not there (rather than that it
+    could not be looked up)
+    """
+    if isinstance(error, ValueError) and error.args:
+        return error.args[0] == 404 # see check_status
+    return isinstance(error, (NotFound, cache.CacheMiss))
+
 def check_status(status_code):
     if status_code != 200:
         raise ValueError(status_code)
 
-def check_url_exist(url):
+def http_get(url, retries=HTTP_RETRIES, deadline=None, **kwargs):
+    """ requests.get, with metrics, timeouts, and retries on
+    throttling/server errors
+
+    Each attempt times out after HTTP_TIMEOUT, or whatever remains of
+    `deadline`, if less. Retries honor the Retry-After header when given
+    (capped at HTTP_RETRY_WAIT), otherwise back off exponentially; they are
+    skipped if the wait would outlast the deadline.
+    """
+    cache.check_online(url)
+    deadline = Deadline.of(deadline)
+    for attempt in range(retries + 1):
+        kwargs['timeout'] = deadline.timeout(HTTP_TIMEOUT)
+        t0 = time.time()
+        try:
+            response = requests.get(url, **kwargs)
+        except requests.RequestException as e:
+            metrics.observe_request(url, time.time() - t0)
+            if isinstance(e, requests.Timeout) and deadline.expired:
+                raise DeadlineExceeded(f"deadline exceeded on {url}") from e
+            raise
+        status = response.status_code
+        metrics.observe_request(url, time.time() - t0, status,
+                                len(response.content))
+        if attempt == retries or not (status == 429 or status >= 500):
+            return response
+        #==== wait and retry
+        metrics.http_retries.inc(host=metrics.host_of(url))
+        wait = response.headers.get('Retry-After', '')
+        wait = float(wait) if wait.isdigit() else 2 ** attempt
+        wait = min(wait, HTTP_RETRY_WAIT)
+        if not deadline.allows(wait):
+            return response
+        time.sleep(wait)
+
+class StoredResponse:
+    """ stands in for the requests.Response of a stored API response,
+    once a 304 Not Modified confirms it is current
+    """
+    status_code = 200
+    def __init__(self, url, content, headers):
+        self.url = url
+        self.content = content
+        self.headers = headers
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def conditional_get(url, deadline=None, params=None, **kwargs):
+    """ http_get, conditional on the validators (ETag, Last-Modified) of
+    the stored response for the same url and params, if any
+
+    If the server replies 304 Not Modified, the stored response is returned
+    (no body is transferred); 200 responses with validators (and bodies of
+    at most cache.RESPONSE_SIZE) are stored. Only done while the record
+    cache is in use (cache.KEEP_RESPONSES); otherwise this is http_get.
+    """
+    if not cache.KEEP_RESPONSES:
+        return http_get(url, deadline=deadline, params=params, **kwargs)
+    key = f"{url}?{urlencode(sorted(params.items()))}" if params else url
+    store = cache.get_cache()
+    stored = store.response(key)
+    headers = dict(kwargs.pop('headers', None) or {})
+    if stored is not None:
+        headers.update(cache.conditional_headers(stored[1]))
+    response = http_get(url, deadline=deadline, params=params,
+                        headers=headers, **kwargs)
+    if response.status_code == 304 and stored is not None:
+        metrics.cache_lookup('revalidated', True)
+        return StoredResponse(key, stored[0], response.headers)
+    validators = cache.validators_of(response.headers)
+    if response.status_code == 200 and validators \
+       and len(response.content) <= cache.RESPONSE_SIZE:
+        store.put_response(key, response.content, validators)
+    return response
+
+def check_url_exist(url, deadline=None):
     """ uses wget to check if a url exists
     Only used currently for checking if SS has paper available
 
@@ -124,13 +274,62 @@ def check_url_exist(url):
     --spider : don't download (just navigate to site)
     --max-redirect 0 : don't follow redirects
         ss will redirect if no paper
+    --timeout, --tries : give up after the time budget, don't retry
     """
-    shcmd = f'wget -q --spider --max-redirect 0 {url}'
-    return subprocess.run(shcmd, shell=True).returncode == 0
+    cache.check_online(url)
+    timeout = Deadline.of(deadline).timeout(HTTP_TIMEOUT)
+    shcmd = (f'wget -q --spider --max-redirect 0 --tries 1 '
+             f'--timeout {timeout:.1f} {url}')
+    try:
+        proc = subprocess.run(shcmd, shell=True, timeout=timeout + 1)
+    except subprocess.TimeoutExpired as e:
+        raise DeadlineExceeded(f"deadline exceeded on {url}") from e
+    return proc.returncode == 0
+
+
+def enrich(info, field, deadline, fetch):
+    """ optional enrichment of info[field] with the value from fetch()
+
+    Skipped if less than ENRICH_MIN_TIME of the deadline is left, or
+    abandoned if the deadline runs out during fetch; either way the field
+    is listed in info.missing rather than failing the query.
+    A fetch returning None leaves the field unset.
+    """
+    if deadline.expires is not None and not deadline.allows(ENRICH_MIN_TIME):
+        info.setdefault('missing', []).append(field)
+        return
+    try:
+        value = fetch()
+    except (DeadlineExceeded, requests.Timeout):
+        info.setdefault('missing', []).append(field)
+        return
+    if value is not None:
+        info[field] = value
 
 
 # Formatting
 # ==========
+AUTHOR_LIMIT = 100 # author lists longer than this are truncated ...
+AUTHOR_KEEP  = 10  # ... to their first AUTHOR_KEEP authors, "et al."
+
+@functools.lru_cache(maxsize=1 << 16)
+def format_name(name):
+    """ "LINNÉA CLAESSON" --> "Linnea Claesson"
+
+    memoized: collaboration members repeat across hundreds of papers
+    """
+    return to_ascii(name).title()
+
+
+def raw_authors(response, crossref=False):
+    """ author names in response, as given """
+    if crossref:
+        return [' '.join(author[k] for k in ('given', 'family')
+                         if author.get(k)) or author.get('name', '')
+                for author in response['author']]
+    return [author['name'] for author in response['authors']]
+
+
 def extract_authors(response, crossref=False):
     """ gets author names from response and formats them
 
@@ -141,17 +340,39 @@ def extract_authors(response, crossref=False):
     "LINNÉA CLAESSON" would be formatted to "Linnea Claesson"
     (note the unicode 'É' is converted to ascii e, and name is titled)
     """
-    authors = []
-    format_name = lambda name: to_ascii(name).title()
-    if crossref:
-        for author in response['author']:
-            name = format_name(f"{author['given']} {author['family']}")
-            authors.append(name)
-    else:
-        for author in response['authors']:
-            name = format_name(author['name'])
-            authors.append(name)
-    return authors
+    return [format_name(name) for name in raw_authors(response, crossref)]
+
+
+def set_authors(info, response, key, crossref=False):
+    """ set info.author from response, in large-collaboration mode
+
+    Papers with more than AUTHOR_LIMIT authors keep only the first
+    AUTHOR_KEEP in info.author, with info.author_count the full count; the
+    full list is stored as-is under key (see authors.py, `full_authors`),
+    so only the kept names are ever formatted.
+    """
+    names = raw_authors(response, crossref)
+    if len(names) > AUTHOR_LIMIT and key:
+        authors.store(key, names)
+        info.author_count = len(names)
+        names = names[:AUTHOR_KEEP]
+    info.author = [format_name(name) for name in names]
+
+
+def full_authors(info):
+    """ all (formatted) authors of processed info, loading a truncated
+    list's full version from disk
+    """
+    if info.get('author_count', 0) > len(info.get('author', [])):
+        names = authors.load(paper_key(info))
+        if names is not None:
+            return [format_name(name) for name in names]
+    return list(info.get('author', []))
+
+
+def paper_key(info):
+    """ library key for processed info: its arXiv ID, else its DOI """
+    return info.get('arxivId') or info.get('DOI')
 
 
 def format_identifier(info):
@@ -177,7 +398,7 @@ def format_filename(info):
 #                                                                             #
 #=============================================================================#
 
-def query_arxiv(arxiv_id):
+def query_arxiv(arxiv_id, deadline=None):
     """ Query arxiv API for a given paper ID
 
     Params
@@ -189,22 +410,125 @@ def query_arxiv(arxiv_id):
             "arxiv.org/pdf/1704.02532.pdf"
             "1807.04587"
 
+    deadline : Deadline | float
+        time budget for the request
+
     Returns
     -------
     response : dict
-        arxiv api response for paper
+        arxiv api response for paper; read from the local metadata
+        snapshot (see snapshot.py) when it has the paper
     """
     import feedparser
     arx_id  = scrub_id(arxiv_id)
     req_url = arxiv_api_paper_url + arx_id
 
+    #==== local snapshot
+    if snapshot.get() is not None:
+        response = snapshot.lookup(arx_id)
+        metrics.cache_lookup('arxiv_snapshot', response is not None)
+        if response is not None:
+            return response
+
     #==== query
-    response = feedparser.parse(req_url)
-    status_code = response.get('status')
-    check_status(status_code)
+    # (fetched with requests rather than feedparser, which has no timeout)
+    response = conditional_get(req_url, deadline=deadline)
+    check_status(response.status_code)
+    response = feedparser.parse(response.content)
     response = response['entries'][0]
     return response
 
+def query_arxiv_batch(arxiv_ids, deadline=None):
+    """ Query arxiv API for many papers, ARXIV_BATCH per request
+    (always the API, not the local snapshot, eg to check for new versions)
+
+    Returns
+    -------
+    responses : dict
+        arxiv id (without version) : arxiv api response for paper
+    """
+    import feedparser
+    arx_ids = [scrub_id(i) for i in arxiv_ids]
+    responses = {}
+    for i in range(0, len(arx_ids), ARXIV_BATCH):
+        if i:
+            time.sleep(ARXIV_WAIT)
+        batch = arx_ids[i:i + ARXIV_BATCH]
+        params = dict(id_list=','.join(batch), max_results=len(batch))
+        response = http_get(arxiv_api_url, params=params, deadline=deadline)
+        check_status(response.status_code)
+        for entry in feedparser.parse(response.content)['entries']:
+            if version_of(entry.get('id', '')) is not None: # not an error entry
+                responses[scrub_id(entry['id'])] = entry
+    return responses
+
+
+def search_arxiv(search_query, max_results=ARXIV_PAGE, sort_by='relevance',
+                 deadline=None):
+    """ stream the results of an arXiv API search, as processed info
+    (see process_arxiv)
+
+    Results are fetched ARXIV_PAGE at a time (fewer for the last page, so
+    no more than max_results are asked for), the next page being requested
+    (ARXIV_WAIT after the last) while the current one is consumed, so the
+    first hits come in before the later pages have been fetched. Pages are
+    kept in the record cache by query, sort, offset and size, for
+    cache.TTL['search'].
+
+    Params
+    ------
+    search_query : str
+        arXiv API query, eg 'ti:transformer AND cat:cs.LG' (plain words
+        search all fields)
+    sort_by : str
+        'relevance', 'lastUpdatedDate' or 'submittedDate' (newest first)
+    """
+    import feedparser
+    last_request = [0.0]
+
+    def fetch_page(start):
+        size = min(ARXIV_PAGE, max_results - start)
+        key = f"{sort_by}|{start}|{size}|{search_query}"
+        page = cache.get_cache().get('search', key)
+        if page is not None:
+            return page
+        time.sleep(max(0, last_request[0] + ARXIV_WAIT - time.time()))
+        params = dict(search_query=search_query, start=start,
+                      max_results=size, sortBy=sort_by,
+                      sortOrder='descending')
+        try:
+            response = http_get(arxiv_api_url, params=params, deadline=deadline)
+        finally:
+            last_request[0] = time.time()
+        check_status(response.status_code)
+        feed = feedparser.parse(response.content)
+        entries = [e for e in feed['entries']  # (not error entries)
+                   if version_of(e.get('id', '')) is not None]
+        page = dict(total=int(feed['feed'].get('opensearch_totalresults', 0)),
+                    entries=[dict(process_arxiv(e)) for e in entries])
+        cache.get_cache().put('search', key, page)
+        return page
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        count, start = 0, 0
+        page = pool.submit(fetch_page, start)
+        while page is not None:
+            results = page.result()
+            start += min(ARXIV_PAGE, max_results - start)
+            more = results['entries'] and start < min(results['total'],
+                                                      max_results)
+            page = pool.submit(fetch_page, start) if more else None
+            for info in results['entries'][:max_results - count]:
+                count += 1
+                yield AttrDict(info)
+
+
+def arxiv_version(response):
+    """ (version, updated) of an arxiv api response,
+    eg (2, '2019-01-03T17:25:23Z')
+    """
+    return version_of(response['id']) or 1, response.get('updated', '')
+
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 def process_arxiv(response, abs_only=False):
@@ -224,20 +548,24 @@ def process_arxiv(response, abs_only=False):
         paper abstract, if abs_only
         else a dict containing all relevant paper info
     """
+    metrics.papers_processed.inc(source='arxiv')
     if abs_only:
         return response.get('summary', 'Unavailable')
 
     #==== process
     arx_id = scrub_id(response['id'])
+    version, updated = arxiv_version(response)
     info = AttrDict(
         URL = arxiv_abs(arx_id),
         pdf = arxiv_pdf(arx_id),
         year  = response['published'][:4],
         title = response['title'],
-        author   = extract_authors(response),
         arxivId  = arx_id,
         abstract = response.get('summary', 'Unavailable'),
+        version  = version,
+        updated  = updated,
         )
+    set_authors(info, response, arx_id)
     return info
 
 
@@ -251,17 +579,21 @@ def process_arxiv(response, abs_only=False):
 #                                                                             #
 #=============================================================================#
 
-def query_ss(ref_id, include_unknown_ref=True, citation_count_only=False):
+def query_ss(ref_id, include_unknown_ref=True, citation_count_only=False,
+             deadline=None):
     """ Query Semantic Scholar (SS) API for given paper reference id
 
     Params
     ------
     ref_id : str
-        either a DOI or an arXiv ID
+        a DOI, an arXiv ID, or an SS paperId
 
     include_unknown_ref : bool
         include references to papers unavailable in SS catalog
 
+    deadline : Deadline | float
+        time budget for the request
+
     Returns
     -------
     response : dict
@@ -329,7 +661,7 @@ def query_ss(ref_id, include_unknown_ref=True, citation_count_only=False):
     """
     #==== format query url
     req_url = ss_api_paper_url
-    ref_is_doi = is_doi(ref_id)
+    ref_is_doi = is_doi(ref_id) or is_ss_id(ref_id)
     if not ref_is_doi:
         ref_id = scrub_id(ref_id)
         req_url += 'arXiv:'
@@ -339,7 +671,7 @@ def query_ss(ref_id, include_unknown_ref=True, citation_count_only=False):
         req_url += "?include_unknown_references=true"
 
     #==== query
-    response = requests.get(req_url)
+    response = conditional_get(req_url, deadline=deadline)
     status_code = response.status_code
     check_status(status_code)
     response = response.json()
@@ -349,11 +681,99 @@ def query_ss(ref_id, include_unknown_ref=True, citation_count_only=False):
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
+def ss_graph_id(ref_id):
+    """ paper id as the SS graph API expects it, eg 'DOI:10.1038/nature16961',
+    'arXiv:1706.03762', or a bare paperId
+    """
+    if is_ss_id(ref_id):
+        return ref_id
+    if is_doi(ref_id):
+        return f"DOI:{ref_id}"
+    return f"arXiv:{scrub_id(ref_id)}"
+
+
+def query_ss_citation_count(ref_id, deadline=None):
+    """ current citation count (and SS paperId) for a paper, without
+    downloading the citations themselves
+
+    Returns
+    -------
+    paper_id : str
+    count : int
+    """
+    req_url = f"{ss_graph_paper_url}{ss_graph_id(ref_id)}"
+    response = conditional_get(req_url, params=dict(fields='citationCount'),
+                               deadline=deadline)
+    check_status(response.status_code)
+    response = response.json()
+    return response['paperId'], response['citationCount']
+
+
+def query_ss_citations(ref_id, offset=0, limit=1000,
+                       fields=('paperId', 'title', 'year'), deadline=None):
+    """ one page of the papers citing ref_id, from the SS graph API,
+    with only the given fields (the smallest payload the API allows)
+
+    Returns
+    -------
+    citing : list(dict)
+        citing papers, with `fields`
+    next_offset : int | None
+        offset of the next page, None if this was the last
+    """
+    req_url = f"{ss_graph_paper_url}{ss_graph_id(ref_id)}/citations"
+    params  = dict(fields=','.join(fields), offset=offset, limit=limit)
+    response = http_get(req_url, params=params, deadline=deadline)
+    check_status(response.status_code)
+    response = response.json()
+    citing = [c['citingPaper'] for c in response.get('data', [])]
+    return citing, response.get('next')
+
+
+def ref_key(ref):
+    """ key for an SS reference or citation entry:
+    its SS paperId, else its DOI or arXiv ID, else its title
+    (unknown references, not in the SS catalog, have no paperId)
+    """
+    if ref.get('paperId'):
+        return ref['paperId']
+    if ref.get('doi'):
+        return f"doi:{ref['doi'].lower()}"
+    if ref.get('arxivId'):
+        return f"arXiv:{ref['arxivId']}"
+    return f"title:{slugify(ref.get('title') or '')}"
+
+
+def reference_ids(paper):
+    """ reference keys for a paper, given as an SS response, processed info,
+    or an iterable of reference entries/keys
+    """
+    refs = (paper.get('references') or []) if isinstance(paper, dict) else paper
+    return [r if isinstance(r, str) else ref_key(r) for r in refs]
+
+
 def fuzz_refs(a, b):
     """ score the similarity of two publications based on the
     similarity or distance between their references
+
+    The score is the jaccard index of the two reference sets, estimated
+    from MinHash signatures (see similarity.py); 0 if either paper has
+    no references.
+
+    Params
+    ------
+    a, b : dict | list
+        SS responses, processed info (with references), or lists of
+        reference entries/keys
+
+    Returns
+    -------
+    score : float
+        estimated similarity in [0, 1]
     """
-    pass
+    sig_a = similarity.signature(reference_ids(a))
+    sig_b = similarity.signature(reference_ids(b))
+    return float(similarity.jaccard(sig_a, sig_b))
 '''
 def format_ref(ref):
     """ format reference for notes """
@@ -412,7 +832,7 @@ def format_ref(ref):
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
-def process_ss(response):
+def process_ss(response, deadline=None):
     """ Query Semantic Scholar API for given paper reference id
 
     Params
@@ -420,43 +840,57 @@ def process_ss(response):
     response : dict
         semantic scholar api response for paper
 
+    deadline : Deadline | float
+        time budget for enrichments (abstract from arxiv, pdf probe);
+        if the budget runs out, they are skipped and listed in info.missing
+
     Returns
     -------
     info : AttrDict
         publication info processed into a dict
     """
+    deadline = Deadline.of(deadline)
     info = AttrDict()
 
     # As-is
     if response['doi']: info.DOI = response['doi']
     if response['year']: info.year = response['year']
     if response['title']: info.title = response['title']
+    if response.get('venue'): info.venue = response['venue']
 
     # formatting
     if response['authors']:
-        info.author = extract_authors(response)
+        set_authors(info, response, response['arxivId'] or response['doi'])
     if response['topics']:
         info.keywords = [kw['topic'] for kw in response['topics']]
     if response['citations']:
         info.citation_count = len(response['citations'])
     if response['references']:
         #[arxivId, authors, doi, isInfluential, paperId, title, url, venue, year]
-        info.references = []
+        info.references = reference_ids(response)
+    info.paperId = response['paperId']
 
-    # arxiv content
+    # arxiv content (a DOI's preprint, if the local snapshot knows of one)
     arxivId = response['arxivId']
+    twin = snapshot.arxiv_twin(info.DOI) if 'DOI' in info else None
     if arxivId:
         info.arxivId = arxivId
         info.URL = arxiv_abs(arxivId)
         info.pdf = arxiv_pdf(arxivId)
-        arx_resp = query_arxiv(arxivId)
-        info.abstract = process_arxiv(arx_resp, abs_only=True)
+        def fetch_abs():
+            response = query_arxiv(arxivId, deadline)
+            info.version, info.updated = arxiv_version(response)
+            return process_arxiv(response, abs_only=True)
+        enrich(info, 'abstract', deadline, fetch_abs)
+    elif twin:
+        info.URL = response['url']
+        info.pdf = arxiv_pdf(twin)
     else:
         info.URL = response['url']
         paper_id = response['paperId']
         pdf_url  = ss_pdf(paper_id)
-        if check_url_exist(pdf_url):
-            info.pdf = pdf_url
+        probe_pdf = lambda: pdf_url if check_url_exist(pdf_url, deadline) else None
+        enrich(info, 'pdf', deadline, probe_pdf)
     return info
 
 
@@ -470,12 +904,12 @@ def process_ss(response):
 #                                                                             #
 #=============================================================================#
 
-def query_crossref(doi, citation_count_only=False):
+def query_crossref(doi, citation_count_only=False, deadline=None):
     assert is_doi(doi)
     req_url = crossref_api_url + str(doi)
 
     #==== query
-    response = requests.get(req_url)
+    response = conditional_get(req_url, deadline=deadline)
     status_code = response.status_code
     check_status(status_code)
     response = response.json()['message']
@@ -485,24 +919,60 @@ def query_crossref(doi, citation_count_only=False):
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
+def query_crossref_batch(dois, fields=CROSSREF_FIELDS, deadline=None):
+    """ Query crossref for many DOIs, CROSSREF_BATCH per request
+    (filter=doi:..,doi:..), fetching only the given fields (select=)
+
+    Returns
+    -------
+    responses : dict
+        lowercased DOI : crossref api response (with only `fields`)
+        DOIs crossref does not know are left out
+    """
+    req_url = crossref_api_url.rstrip('/')
+    responses = {}
+    for i in range(0, len(dois), CROSSREF_BATCH):
+        batch = dois[i:i + CROSSREF_BATCH]
+        params = {'filter': ','.join(f"doi:{doi}" for doi in batch),
+                  'select': ','.join(fields), 'rows': len(batch)}
+        response = http_get(req_url, params=params, deadline=deadline)
+        check_status(response.status_code)
+        for item in response.json()['message']['items']:
+            responses[item['DOI'].lower()] = item
+    return responses
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
 def process_crossref(response):
     """ process crossref api response
+
+    Works on full responses and on those with only some fields selected
+    (see CROSSREF_FIELDS); missing fields are left out of info.
     """
     info = AttrDict()
 
     # As-is
     info.DOI = response['DOI']
-    info.URL = response['URL']
-    if response['title']:
-        info.title = response['title'].pop(0)
+    if response.get('URL'):
+        info.URL = response['URL']
+    if response.get('title'):
+        info.title = response['title'][0]
 
     # formatting
-    if response['created']['date-time']: # eg 2008-06-20T08:06:09Z
-        info.year = response['created']['date-time'][:4]
-    if response['author']:
-        info.author = extract_authors(response, crossref=True)
-    if response['is-referenced-by-count']:
+    created = response.get('created') or {}
+    if created.get('date-time'): # eg 2008-06-20T08:06:09Z
+        info.year = created['date-time'][:4]
+    if response.get('author'):
+        set_authors(info, response, info.DOI, crossref=True)
+    if response.get('is-referenced-by-count'):
         info.citation_count = response['is-referenced-by-count']
+    if response.get('container-title'):
+        info.venue = response['container-title'][0]
+    if response.get('publisher'):
+        info.publisher = response['publisher']
+    twin = snapshot.arxiv_twin(info.DOI)
+    if twin:
+        info.pdf = arxiv_pdf(twin)
     #code.interact(local=dict(globals(), **locals()))
     return info
 
@@ -524,51 +994,263 @@ def get_book(isbn):
 #-----------------------------------------------------------------------------#
 #                                  Interface                                  #
 #-----------------------------------------------------------------------------#
-def query(ref_id):
-    try:
-        response = query_ss(ref_id)
-        info = process_ss(response)
-        info.identifier = format_identifier(info)
-        info.filename   = format_filename(info)
-        return info
-    except ValueError as v:
-        print(f"\tHTTP Error {v}")
-        if v == '404':
-            print("\tUnable to find reference in Semantic Scholar"
-                  "\tnow checking CrossRef...\n")
-        response = query_crossref(ref_id)
+def _query_ss(ref_id, deadline=None):
+    with memprof.stage('query_ss'):
+        response = query_ss(ref_id, deadline=deadline)
+    for hook in ss_response_hooks:
+        hook(response)
+    with memprof.stage('process_ss'):
+        info = process_ss(response, deadline=deadline)
+    return info
+
+def _query_crossref(ref_id, deadline=None):
+    with memprof.stage('query_crossref'):
+        response = query_crossref(ref_id, deadline=deadline)
+    with memprof.stage('process_crossref'):
         info = process_crossref(response)
+    return info
+
+# backend : (name, query-and-process func)
+BACKENDS = dict(ss=('Semantic Scholar', _query_ss),
+                crossref=('CrossRef', _query_crossref))
+
+
+def merge_info(ss_info, cr_info):
+    """ field-level merge of processed SS and CrossRef info
+
+    SS fields are kept (keywords, arxiv links, pdf, abstract), with gaps
+    filled from CrossRef. CrossRef's URL is preferred, since it points to
+    the publisher rather than SS, and the larger citation count is kept.
+    """
+    info = AttrDict(cr_info)
+    info.update(ss_info)
+    if 'URL' in cr_info:
+        info.URL = cr_info.URL
+    counts = [i['citation_count'] for i in (ss_info, cr_info)
+              if 'citation_count' in i]
+    if counts:
+        info.citation_count = max(counts)
+    return info
+
+
+def is_complete(info, fields=None):
+    """ whether info has all fields needed to meet the completeness bar """
+    fields = HEDGE_FIELDS if fields is None else fields
+    return all(info.get(f) for f in fields)
+
+
+def query_hedged(ref_id, backends=('ss', 'crossref'), window=None,
+                 fields=None, deadline=None):
+    """ query backends for a DOI concurrently and merge their results
+
+    Returns as soon as a result meets the completeness bar (`fields`) and
+    either every backend has answered or `window` seconds (default
+    HEDGE_DEADLINE) have passed since the queries were sent; if both
+    answered, their fields are merged. The overall `deadline` always wins.
+    Requests still pending are cancelled; a request already in flight
+    cannot be interrupted, so it finishes in the background and its result
+    is discarded.
+
+    Returns
+    -------
+    info : AttrDict | None
+        merged info, or None if all backends failed
+    source : str | dict
+        backend(s) the info came from, eg 'ss', 'ss+crossref'; if all
+        failed, backend : exception for those that raised
+    """
+    window   = HEDGE_DEADLINE if window is None else window
+    deadline = Deadline.of(deadline)
+    t0 = time.time()
+    executor = ThreadPoolExecutor(len(backends))
+    futures  = {executor.submit(BACKENDS[b][1], ref_id, deadline): b
+                for b in backends}
+    results, errors, pending = {}, {}, set(futures)
+    while pending:
+        timeout = deadline.remaining()
+        if any(is_complete(i, fields) for i in results.values()):
+            timeout = min(timeout, max(0, t0 + window - time.time()))
+        timeout = None if timeout == float('inf') else timeout
+        done, pending = wait(pending, timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            break # window or deadline passed
+        for future in done:
+            backend = futures[future]
+            try:
+                results[backend] = future.result()
+                routing.record(ref_id, backend, hit=True)
+            except ValueError as v:
+                errors[backend] = v
+                if v.args and v.args[0] == 404:
+                    routing.record(ref_id, backend, hit=False)
+            except Exception as e:
+                errors[backend] = e
+    for future in pending:
+        future.cancel()
+    executor.shutdown(wait=False)
+    if not results:
+        deadline.check()
+
+    if 'ss' in results and 'crossref' in results:
+        return merge_info(results['ss'], results['crossref']), 'ss+crossref'
+    for backend, info in results.items():
+        return info, backend
+    return None, errors
+
+
+@metrics.instrument('query')
+def query(ref_id, hedge=None, deadline=None):
+    """ query and process info for ref_id
+
+    Backends are tried in the order given by the router (see routing.py),
+    which skips backends known to miss this id or its DOI prefix;
+    normally SS first, then CrossRef for DOIs.
+
+    If hedge (default HEDGE), DOIs are sent to all routed backends at once,
+    see query_hedged.
+
+    deadline (Deadline or seconds) bounds the whole query; each request
+    gets the remaining budget. Optional enrichments are dropped when the
+    budget runs short (see info.missing); DeadlineExceeded is raised if
+    no record could be had in time.
+    """
+    if cache.OFFLINE:
+        return query_offline(ref_id)
+    hedge = HEDGE if hedge is None else hedge
+    deadline = Deadline.of(deadline)
+    ref_id   = normalize_id(ref_id)
+    ref_key  = ref_id if is_doi(ref_id) else scrub_id(ref_id)
+    backends = routing.route(ref_key)
+    errors = []
+    if hedge and len(backends) > 1:
+        info, source = query_hedged(ref_id, backends, deadline=deadline)
+        if info is not None:
+            info.identifier = format_identifier(info)
+            info.filename   = format_filename(info)
+            metrics.papers_processed.inc(source=source)
+            return info
+        errors, backends = list(source.values()), [] # all failed
+    for i, backend in enumerate(backends):
+        name, query_backend = BACKENDS[backend]
+        try:
+            info = query_backend(ref_id, deadline)
+        except DeadlineExceeded:
+            raise
+        except ValueError as v:
+            errors.append(v)
+            print(f"\tHTTP Error {v}")
+            status = v.args[0] if v.args else None
+            if status == 404:
+                routing.record(ref_key, backend, hit=False)
+                print(f"\tUnable to find reference in {name}")
+            if i + 1 < len(backends):
+                print(f"\tnow checking {BACKENDS[backends[i+1]][0]}...\n")
+            continue
+        except Exception as e:
+            errors.append(e)
+            break
+        routing.record(ref_key, backend, hit=True)
         info.identifier = format_identifier(info)
         info.filename   = format_filename(info)
+        metrics.papers_processed.inc(source=backend)
         return info
-    except:
-        msg = f"""\
-        \tQuery unsuccessful for {ref_id}
-        \tif valid reference id, then it may not be catalogued"""
-        raise Exception(msg)
+    msg = f"""\
+    \tQuery unsuccessful for {ref_id}
+    \tif valid reference id, then it may not be catalogued"""
+    # not found, unless some backend failed for another reason
+    failed = [e for e in errors if not is_not_found(e)]
+    if failed:
+        raise Exception(msg) from failed[-1]
+    raise NotFound(msg) from (errors[-1] if errors else None)
+
+
+def query_offline(ref_id):
+    """ info for ref_id from local data only: the record cache (however
+    old), else the arXiv snapshot; raises cache.CacheMiss if neither has it
+    """
+    ref_id = normalize_id(ref_id)
+    info = cache.get_cache().get('info', ref_id, max_age=float('inf'))
+    if info is not None:
+        return AttrDict(info)
+    response = None if is_doi(ref_id) else snapshot.lookup(scrub_id(ref_id))
+    if response is None:
+        raise cache.CacheMiss(f"offline, and {ref_id} is not cached locally")
+    info = process_arxiv(response)
+    info.identifier = format_identifier(info)
+    info.filename   = format_filename(info)
+    return info
 
 
-def get_citation_count(ref_id):
-    """ checks approx. number of citations for given ref id
+def query_crossref_many(dois, deadline=None, jobs=1):
+    """ query and process info for many DOIs with batched crossref requests;
+    responses are processed by `jobs` processes (see workers.py)
+
+    Returns
+    -------
+    infos : dict
+        DOI (as given) : info, for the DOIs crossref knows
+    """
+    import workers
+    deadline  = Deadline.of(deadline)
+    responses = query_crossref_batch(dois, deadline=deadline)
+    found = []
+    for doi in dois:
+        response = responses.get(doi.lower())
+        routing.record(doi, 'crossref', hit=response is not None)
+        if response is not None:
+            found.append((doi, response))
+    processed = workers.process_map(workers.process_crossref,
+                                    [r for _, r in found], jobs)
+    infos = {}
+    for (doi, _), info in zip(found, processed):
+        if info is None:
+            continue # no author or year; left to query()
+        metrics.papers_processed.inc(source='crossref')
+        infos[doi] = AttrDict(info)
+    return infos
+
+
+@metrics.instrument('count')
+def citation_counts(ref_id):
+    """ approx. number of citations for given ref id, by source
     if ref is arxiv id, then only check ss api
     if ref is doi, check both ss and crossref api
+
+    Returns
+    -------
+    counts : dict
+        {'ss': int[, 'crossref': int]}
     """
-    if not is_doi(ref_id):
-        # arXiv ID
-        try:
-            ss_num_cit = query_ss(ref_id, citation_count_only=True)
-            arx_id = scrub_id(ref_id)
-            msg = (f"\nCitation count for {arx_id}:\n"
-                   f"\tSemantic Scholar: {ss_num_cit}")
-        except:
-            msg = (f"\nERROR: No results found from Semantic Scholar")
+    if cache.OFFLINE:
+        counts = cache.get_cache().get('count', normalize_id(ref_id))
+        if counts is None:
+            raise cache.CacheMiss(f"offline, and no citation count for {ref_id}")
+        return counts
+    counts = dict(ss=query_ss(ref_id, citation_count_only=True))
+    if is_doi(ref_id):
+        counts['crossref'] = query_crossref(ref_id, citation_count_only=True)
+    return counts
+
+
+def print_citation_counts(ref_id, counts):
+    if 'crossref' not in counts:
+        msg = (f"\nCitation count for {scrub_id(ref_id)}:\n"
+               f"\tSemantic Scholar: {counts['ss']}")
     else:
-        try:
-            ss_num_cit = query_ss(ref_id, citation_count_only=True)
-            cr_num_cit = query_crossref(ref_id, citation_count_only=True)
-            msg = (f"\nCitation count for {ref_id}:\n"
-                   f"\tSemantic Scholar: {ss_num_cit}\n"
-                   f"\t        CrossRef: {cr_num_cit}\n")
-        except:
-            msg = (f"\nERROR: No results found from either SS or CrossRef")
+        msg = (f"\nCitation count for {ref_id}:\n"
+               f"\tSemantic Scholar: {counts['ss']}\n"
+               f"\t        CrossRef: {counts['crossref']}\n")
     print(msg)
+
+
+def get_citation_count(ref_id):
+    """ prints approx. number of citations for given ref id
+    (see citation_counts)
+    """
+    try:
+        counts = citation_counts(ref_id)
+    except:
+        source = 'either SS or CrossRef' if is_doi(ref_id) else 'Semantic Scholar'
+        print(f"\nERROR: No results found from {source}")
+        return
+    print_citation_counts(ref_id, counts)
@@ -0,0 +1,132 @@
+"""
+Related-paper ranking over the local citation graph (see graph.py).
+
+All scores are sparse matrix-vector products over the citation adjacency
+matrix A (A[u, v] = 1 if u cites v), so ranking a graph of a few million
+edges takes well under a second.
+
+co-citation
+    papers cited together with library papers:  A.T @ (A @ lib)
+    (how many papers cite both the candidate and some library paper)
+
+bibliographic coupling
+    papers citing the same work as library papers:  A @ (A.T @ lib)
+    (how many references the candidate shares with library papers)
+
+personalized PageRank
+    stationary distribution of a random walk over citations (in either
+    direction) that restarts at the seed paper(s) with prob 1 - ALPHA
+"""
+import numpy as np
+import scipy.sparse as sp
+
+
+ALPHA = 0.85     # pagerank damping
+PPR_TOL = 1e-4   # L1 convergence tolerance (plenty for a top-k ranking)
+PPR_MAX_ITER = 100
+METHODS = ['cocite', 'couple', 'ppr', 'all']
+
+
+def adjacency(graph):
+    """ (n, n) binary CSR citation matrix of a CitationGraph
+
+    The compacted CSR arrays are used as-is; only the uncompacted tail
+    of the edge log is converted.
+    """
+    n = len(graph.keys)
+    indptr = np.asarray(graph.out_indptr)
+    # nodes added since compaction have empty rows
+    indptr = np.concatenate([indptr, np.full(n + 1 - len(indptr), indptr[-1])])
+    data = np.ones(len(graph.out_indices), dtype=np.float32)
+    A = sp.csr_matrix((data, np.asarray(graph.out_indices), indptr), shape=(n, n))
+    tail = graph._tail
+    if len(tail):
+        ones = np.ones(len(tail), dtype=np.float32)
+        A = A + sp.csr_matrix((ones, (tail[:, 0], tail[:, 1])), shape=(n, n))
+        A.data[:] = 1  # duplicate edges count once
+    return A
+
+
+def cocitation(A, seeds):
+    return A.T @ (A @ seeds)
+
+def coupling(A, seeds):
+    return A @ (A.T @ seeds)
+
+def personalized_pagerank(A, seeds, alpha=ALPHA, tol=PPR_TOL,
+                          max_iter=PPR_MAX_ITER):
+    """ personalized pagerank by power iteration
+
+    The walk follows citations in either direction; dangling nodes
+    (no edges) jump back to the seeds.
+    """
+    W = (A + A.T).tocsr()
+    degree = np.asarray(W.sum(axis=1)).ravel()
+    inv_deg = np.divide(1.0, degree, out=np.zeros_like(degree), where=degree > 0)
+    P = W.multiply(inv_deg).tocsr()  # P[i, j] = W[i, j] / deg[j] (W symmetric)
+    # float32 throughout; mixing in float64 vectors doubles the matvec cost
+    restart = (seeds / seeds.sum()).astype(np.float32)
+    dangling = np.flatnonzero(degree == 0)
+    rank = restart.copy()
+    for _ in range(max_iter):
+        prev = rank
+        rank = alpha * (P @ rank + rank[dangling].sum() * restart) \
+               + (1 - alpha) * restart
+        if np.abs(rank - prev).sum() < tol:
+            break
+    return rank
+
+
+def rank(graph, ref=None, method='all', k=20, A=None):
+    """ rank papers related to the library, or to paper `ref`
+
+    Co-citation and coupling are scored against the library (plus ref, if
+    given); pagerank is seeded from ref if given, else the whole library.
+    With method 'all', each score is scaled to [0, 1] and summed.
+    Papers in the library, and ref itself, are excluded.
+
+    Returns
+    -------
+    ranked : list((node, score))
+        up to k best candidates, best first
+    """
+    A = adjacency(graph) if A is None else A
+    n = A.shape[0]
+    library = graph.library_mask().astype(np.float64)
+    seed = None
+    if ref is not None:
+        seed = graph.node(ref)
+        if seed is None:
+            raise KeyError(f"{ref} is not in the citation graph")
+    target = library.copy()
+    if seed is not None:
+        target[seed] = 1
+    if not target.any():
+        return []
+
+    scorers = dict(
+        cocite = lambda: cocitation(A, target),
+        couple = lambda: coupling(A, target),
+        ppr    = lambda: personalized_pagerank(A, _seed_vector(n, seed, target)))
+    if method == 'all':
+        scores = np.zeros(n)
+        for score in (s() for s in scorers.values()):
+            top = score.max()
+            if top > 0:
+                scores += score / top
+    else:
+        scores = np.asarray(scorers[method](), dtype=np.float64)
+
+    scores[target > 0] = 0
+    k = min(k, n)
+    top = np.argpartition(-scores, k - 1)[:k] if k else []
+    top = sorted(top, key=lambda i: -scores[i])
+    return [(int(i), float(scores[i])) for i in top if scores[i] > 0]
+
+
+def _seed_vector(n, seed, library):
+    if seed is None:
+        return library
+    vec = np.zeros(n)
+    vec[seed] = 1
+    return vec
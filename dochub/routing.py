@@ -0,0 +1,177 @@
+"""
+Adaptive backend routing for paper queries.
+
+Semantic Scholar (SS) is the preferred backend, but for many DOI prefixes
+(eg, Springer books '10.1007/978-...') it 404s every time, and each of those
+lookups pays a wasted SS round trip before falling back to CrossRef.
+
+The router keeps a small persistent store of:
+  * negative results per ref id: backends that 404'd on that id
+  * hit/try counts per DOI prefix for each backend
+
+and orders backends for new lookups by their (smoothed) hit rate for the
+prefix. Every PROBE_EVERY lookups for a prefix, the default order is used
+anyway, so a prefix that SS starts covering is picked back up.
+
+arXiv ids are only ever routed to SS (CrossRef does not index them).
+"""
+import os
+import json
+import time
+import atexit
+import threading
+
+
+#-----------------------------------------------------------------------------#
+#                                  Constants                                  #
+#-----------------------------------------------------------------------------#
+CACHE_DIR   = f"{os.path.abspath(os.path.dirname(__file__))}/.cache"
+ROUTES_FILE = f"{CACHE_DIR}/routes.json"
+
+BACKENDS = ['ss', 'crossref']  # default order
+NEG_TTL = 30 * 24 * 3600       # seconds a miss on an id is remembered
+MIN_TRIES = 5                  # tries before a prefix's hit rate is trusted
+MAX_TRIES = 200                # counts are halved past this, to favor recent
+PROBE_EVERY = 25               # lookups per prefix between probes
+SAVE_EVERY = 20                # updates between saves (also saved at exit)
+
+
+def doi_prefix(doi):
+    """ routing key for a DOI: the registrant code, plus the ISBN marker
+    for book DOIs, whose coverage differs a lot from the same publisher's
+    journals
+
+    Examples
+    --------
+    doi_prefix('10.1038/nature16961')          --> '10.1038'
+    doi_prefix('10.1007/978-3-319-67669-2_11') --> '10.1007/978'
+    """
+    registrant, _, suffix = doi.partition('/')
+    if suffix[:4] in ('978-', '979-'):
+        return f"{registrant}/{suffix[:3]}"
+    return registrant
+
+
+#-----------------------------------------------------------------------------#
+#                                   Router                                    #
+#-----------------------------------------------------------------------------#
+
+class Router:
+    """ orders query backends per ref id, learning from past lookups
+
+    Store format (json)
+    -------------------
+    misses : {ref_id: {backend: timestamp}}
+    prefixes : {prefix: {backend: [hits, tries]}}
+    lookups : {prefix: num lookups routed}
+    """
+    def __init__(self, path=ROUTES_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.misses   = {}
+        self.prefixes = {}
+        self.lookups  = {}
+        self._dirty = 0
+        self.load()
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path) as file:
+                store = json.load(file)
+            self.misses   = store.get('misses', {})
+            self.prefixes = store.get('prefixes', {})
+            self.lookups  = store.get('lookups', {})
+
+    def save(self):
+        with self.lock:
+            store = dict(misses=self.misses, prefixes=self.prefixes,
+                         lookups=self.lookups)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, 'w') as file:
+                json.dump(store, file)
+            os.replace(tmp, self.path)
+            self._dirty = 0
+
+    #==== lookups
+    def missed(self, ref_id, backend):
+        """ whether backend recently 404'd on ref_id """
+        ts = self.misses.get(ref_id, {}).get(backend)
+        return ts is not None and time.time() - ts < NEG_TTL
+
+    def hit_rate(self, prefix, backend):
+        """ laplace-smoothed hit rate; 0.5 when unknown """
+        hits, tries = self.prefixes.get(prefix, {}).get(backend, [0, 0])
+        if tries < MIN_TRIES:
+            return 0.5
+        return (hits + 1) / (tries + 2)
+
+    def route(self, ref_id):
+        """ backends to try for ref_id, in order """
+        if ref_id[:3] != '10.':
+            return ['ss']
+        prefix = doi_prefix(ref_id)
+        with self.lock:
+            num = self.lookups.get(prefix, 0) + 1
+            self.lookups[prefix] = num
+        probe = num % PROBE_EVERY == 0
+        order = list(BACKENDS)
+        if not probe:
+            # stable sort keeps default (ss first) on ties
+            order.sort(key=lambda b: -self.hit_rate(prefix, b))
+        # drop backends known to miss this id; unless they are all known
+        # misses, in which case try anyway (misses may be stale)
+        fresh = [b for b in order if not self.missed(ref_id, b)]
+        return fresh or order
+
+    #==== updates
+    def record(self, ref_id, backend, hit):
+        """ record result of querying backend for ref_id """
+        with self.lock:
+            if hit:
+                self.misses.get(ref_id, {}).pop(backend, None)
+                if ref_id in self.misses and not self.misses[ref_id]:
+                    del self.misses[ref_id]
+            else:
+                self.misses.setdefault(ref_id, {})[backend] = time.time()
+            if ref_id[:3] == '10.':
+                stats = self.prefixes.setdefault(doi_prefix(ref_id), {})
+                counts = stats.setdefault(backend, [0, 0])
+                counts[0] += int(hit)
+                counts[1] += 1
+                if counts[1] > MAX_TRIES:
+                    counts[0] //= 2
+                    counts[1] //= 2
+            self._dirty += 1
+            dirty = self._dirty
+        if dirty >= SAVE_EVERY:
+            self.save()
+
+    def expire(self):
+        """ drop expired negative results """
+        now = time.time()
+        with self.lock:
+            for ref_id in list(self.misses):
+                live = {b: ts for b, ts in self.misses[ref_id].items()
+                        if now - ts < NEG_TTL}
+                if live:
+                    self.misses[ref_id] = live
+                else:
+                    del self.misses[ref_id]
+
+
+#-----------------------------------------------------------------------------#
+#                                  Interface                                  #
+#-----------------------------------------------------------------------------#
+_router = None
+
+def get_router():
+    global _router
+    if _router is None:
+        _router = Router()
+        _router.expire()
+        atexit.register(lambda: _router._dirty and _router.save())
+    return _router
+
+route  = lambda ref_id: get_router().route(ref_id)
+record = lambda ref_id, backend, hit: get_router().record(ref_id, backend, hit)
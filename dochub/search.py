@@ -0,0 +1,219 @@
+"""
+Full-text search over the library: paper titles, abstracts and keywords,
+and the notes in the notes directory.
+
+An inverted index (term --> {doc: weighted term frequency}) is ranked with
+BM25, with title and keyword matches weighted above the body:
+
+    score(d, q) = sum_t  idf(t) * tf(t, d) * (K1 + 1)
+                         / (tf(t, d) + K1 * (1 - B + B * len(d) / avg_len))
+
+Papers are added as they are queried (their abstracts are otherwise only
+ever in memory); notes are picked up by `update_notes`, which only
+re-tokenizes note files whose mtime changed since the last update.
+A note and the paper it was generated for (same filename) are one hit.
+
+The index is pickled to a single file; plain dicts of interned strings and
+ints keep it compact and quick to load.
+"""
+import os
+import re
+import sys
+import math
+import heapq
+import pickle
+
+
+K1 = 1.2
+B  = 0.75
+FIELD_WEIGHTS = dict(title=3, keywords=2, author=2, abstract=1, body=1)
+
+STOPWORDS = set("""
+a an and are as at be by for from has have in is it its of on or that the
+this to was were which with we our these those their can via using based
+""".split())
+
+_token_re = re.compile(r"[a-z0-9]+(?:[-'][a-z0-9]+)*")
+
+
+def tokenize(text):
+    return [sys.intern(t) for t in _token_re.findall(text.lower())
+            if t not in STOPWORDS]
+
+
+def parse_note(text):
+    """ fields of a notes file (see documents.Document.generate_notes):
+    keywords, title (the overlined top heading) and body
+    """
+    fields = dict(keywords='', title='', body=[])
+    lines = text.split('\n')
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        if stripped.startswith(':keywords:'):
+            fields['keywords'] = stripped[len(':keywords:'):]
+        elif (not fields['title'] and 0 < i < len(lines) - 1 and stripped
+              and set(lines[i-1].strip()) == {'#'}
+              and set(lines[i+1].strip()) == {'#'}):
+            fields['title'] = stripped
+        elif stripped and not set(stripped) <= set('#*=-^~'):
+            fields['body'].append(line)
+    fields['body'] = '\n'.join(fields['body'])
+    return fields
+
+
+class SearchIndex:
+    """ BM25 inverted index over papers and notes
+
+    Docs are keyed by name ('paper:<arxivId|DOI>' or 'note:<file stem>'),
+    and carry display metadata (title, filename, path).
+    """
+    def __init__(self):
+        self.names = []     # doc id : name (None once removed)
+        self.ids   = {}     # name : doc id
+        self.docs  = {}     # doc id : dict(length, terms, mtime, title, ...)
+        self.postings = {}  # term : {doc id : weighted tf}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.docs)
+
+    #==== building
+    def add(self, name, fields, **meta):
+        """ (re-)index doc `name` from its text fields """
+        self.remove(name)
+        tf = {}
+        for field, text in fields.items():
+            weight = FIELD_WEIGHTS.get(field, 1)
+            if isinstance(text, (list, tuple)):
+                text = ' '.join(text)
+            for term in tokenize(text or ''):
+                tf[term] = tf.get(term, 0) + weight
+        doc = len(self.names)
+        self.names.append(name)
+        self.ids[name] = doc
+        length = sum(tf.values())
+        self.docs[doc] = dict(meta, length=length, terms=tuple(tf))
+        self.total_length += length
+        for term, count in tf.items():
+            self.postings.setdefault(term, {})[doc] = count
+        return doc
+
+    def remove(self, name):
+        doc = self.ids.pop(name, None)
+        if doc is None:
+            return
+        info = self.docs.pop(doc)
+        self.names[doc] = None
+        self.total_length -= info['length']
+        for term in info['terms']:
+            posting = self.postings[term]
+            del posting[doc]
+            if not posting:
+                del self.postings[term]
+
+    def add_paper(self, info):
+        """ index a processed paper (query.AttrDict) """
+        key = info.get('arxivId') or info.get('DOI')
+        fields = {f: info.get(f) for f in ('title', 'abstract', 'keywords',
+                                           'author')}
+        self.add(f"paper:{key}", fields, title=info.get('title'),
+                 filename=info.get('filename'), key=key)
+
+    def update_notes(self, notes_dir):
+        """ re-index notes files changed since the last update, and drop
+        those that were removed
+
+        Returns
+        -------
+        changed : int
+            number of notes (re-)indexed or removed
+        """
+        seen = set()
+        changed = 0
+        entries = os.scandir(notes_dir) if os.path.isdir(notes_dir) else []
+        for entry in entries:
+            if not entry.name.endswith('.rst') or not entry.is_file():
+                continue
+            name = f"note:{entry.name[:-4]}"
+            seen.add(name)
+            mtime = entry.stat().st_mtime
+            doc = self.ids.get(name)
+            if doc is not None and self.docs[doc]['mtime'] == mtime:
+                continue
+            with open(entry.path, encoding='utf-8', errors='replace') as file:
+                fields = parse_note(file.read())
+            self.add(name, fields, title=fields['title'], mtime=mtime,
+                     filename=entry.name[:-4], path=entry.path)
+            changed += 1
+        for name in [n for n in self.ids if n.startswith('note:')]:
+            if name not in seen:
+                self.remove(name)
+                changed += 1
+        return changed
+
+    #==== search
+    def search(self, query, k=10):
+        """ top k docs for query, merging a note with its paper
+
+        Returns
+        -------
+        hits : list((score, doc metadata))
+            best first
+        """
+        if not self.docs:
+            return []
+        n = len(self.docs)
+        avg_length = self.total_length / n
+        scores = {}
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for doc, tf in posting.items():
+                norm = K1 * (1 - B + B * self.docs[doc]['length'] / avg_length)
+                scores[doc] = scores.get(doc, 0) + idf * tf * (K1 + 1) / (tf + norm)
+        best = {} # filename (or name) : (score, doc)
+        for doc, score in scores.items():
+            group = self.docs[doc].get('filename') or self.names[doc]
+            prev = best.get(group)
+            if prev is None:
+                best[group] = (score, doc)
+            else:
+                # keep the top score, but point at the note if there is one
+                note = doc if 'path' in self.docs[doc] else prev[1]
+                best[group] = (max(score, prev[0]), note)
+        top = heapq.nlargest(k, best.values())
+        return [(score, dict(self.docs[doc], name=self.names[doc]))
+                for score, doc in top]
+
+    #==== persistence
+    def compact(self):
+        """ renumber docs, dropping the slots of removed ones """
+        index = SearchIndex()
+        index.names = [n for n in self.names if n is not None]
+        index.ids = {name: i for i, name in enumerate(index.names)}
+        remap = {self.ids[name]: i for i, name in enumerate(index.names)}
+        index.docs = {remap[d]: info for d, info in self.docs.items()}
+        index.postings = {t: {remap[d]: tf for d, tf in p.items()}
+                          for t, p in self.postings.items()}
+        index.total_length = self.total_length
+        return index
+
+    def save(self, path):
+        index = self.compact() if len(self.names) > 2 * len(self.docs) else self
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, 'wb') as file:
+            pickle.dump(vars(index), file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """ load index from path; empty index if path does not exist """
+        index = cls()
+        if os.path.exists(path):
+            with open(path, 'rb') as file:
+                state = pickle.load(file)
+            vars(index).update(state)
+        return index
@@ -0,0 +1,273 @@
+"""
+Local lookup service, shared by the people and scripts on one host.
+
+`dochub.py serve` runs an HTTP/JSON server in front of query.query,
+citation counts and bib rendering:
+
+    GET /query?id=<ref id>[&deadline=<seconds>][&fresh=1]
+                                                  processed info (JSON)
+    GET /count?id=<ref id>                        {"ss": n, "crossref": n}
+    GET /bib?id=<ref id>[&style=bibtex|yaml]      bib entry (text)
+
+Errors are returned as {"error": message}, with status 400 (bad request),
+404 (paper not found), 502 (upstream API failed), 504 (deadline exceeded)
+or 500 (anything else).
+
+Results are served from the record cache (see cache.py); stale records
+are served at once and refreshed in the background, and concurrent
+requests for the same (normalized) id wait on one upstream fetch.
+`fresh=1` revalidates the record before answering (for downloads, which
+need the current pdf link and version). Clients use the service through
+`Client`, eg with `dochub.py --service URL ...`.
+"""
+import json
+import queue
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import requests
+
+import metrics
+import query as q
+import cache
+from cache import get_cache, Coalescer
+from timing import Deadline, DeadlineExceeded
+
+
+HOST = '127.0.0.1'
+PORT = 8765
+REFRESH_DEADLINE = 60  # seconds for a background refresh
+REFRESH_WORKERS  = 2
+REFRESH_GRACE    = 3   # seconds a one-shot run waits at exit for refreshes
+
+
+#-----------------------------------------------------------------------------#
+#                                  Resolver                                   #
+#-----------------------------------------------------------------------------#
+class Resolver:
+    """ cached, coalesced lookups
+
+    If serve_stale, stale records are returned at once and refreshed in
+    the background, otherwise they are revalidated before returning (eg
+    for prefetch, which is there to bring records up to date).
+
+    Refreshes run on daemon threads, so they never hold up the exit of a
+    one-shot run; such runs give them a moment to finish with `drain`.
+    """
+    def __init__(self, records=None, serve_stale=False):
+        self.cache = records or get_cache()
+        self.serve_stale = serve_stale
+        cache.KEEP_RESPONSES = True # (to revalidate records cheaply)
+        self.coalescer = Coalescer()
+        self.refresher = None  # queue of refreshes, once needed
+        self.refreshing = set()  # (kind, key) being refreshed
+        self.lock = threading.Lock()
+        self.refreshed = threading.Condition(self.lock)
+
+    def _store(self, kind, key, value):
+        if not value.get('missing'): # complete (not cut short)
+            self.cache.put(kind, key, value)
+
+    def _lookup(self, kind, ref_id, fetch, deadline=None, fresh=False):
+        """ value for ref_id; fetch(key, deadline) gets it upstream
+
+        If fresh, the record is revalidated upstream (a conditional
+        request, see query.conditional_get) however recent it is.
+        """
+        deadline = Deadline.of(deadline)
+        key = q.normalize_id(ref_id)
+        entry = None if fresh and not cache.OFFLINE else \
+                self.cache.entry(kind, key)
+        if entry is not None:
+            value, age = entry
+            if age <= cache.TTL[kind] or cache.OFFLINE:
+                return value
+            if self.serve_stale and age <= cache.STALE[kind]:
+                self._refresh(kind, key, fetch)
+                return value
+        def fetch_and_store():
+            # filled while we waited?
+            value = None if fresh else self.cache.get(kind, key)
+            if value is None:
+                value = fetch(key, deadline)
+                self._store(kind, key, value)
+            return value
+        # a caller waiting on another's fetch waits for its own budget; if
+        # the other's budget ran out first, it fetches itself
+        for attempt in range(2):
+            timeout = None if deadline.expires is None else deadline.timeout()
+            try:
+                return self.coalescer.call((kind, key), fetch_and_store,
+                                           timeout=timeout)
+            except DeadlineExceeded:
+                if attempt or deadline.expired:
+                    raise
+
+    def _refresh(self, kind, key, fetch):
+        """ refetch a stale record in the background, unless already being
+        refetched; the request is conditional (see query.conditional_get),
+        so an unchanged record costs a 304
+        """
+        with self.lock:
+            if (kind, key) in self.refreshing:
+                return
+            self.refreshing.add((kind, key))
+            if self.refresher is None:
+                self.refresher = queue.Queue()
+                for _ in range(REFRESH_WORKERS):
+                    threading.Thread(target=self._refresh_worker,
+                                     daemon=True).start()
+        metrics.cache_lookup('stale', True)
+        def refresh():
+            try:
+                self._store(kind, key, fetch(key, REFRESH_DEADLINE))
+            except Exception as e:
+                print(f"  background refresh of {key} failed: {e}")
+            finally:
+                with self.lock:
+                    self.refreshing.discard((kind, key))
+                    self.refreshed.notify_all()
+        self.refresher.put(refresh)
+
+    def _refresh_worker(self):
+        while True:
+            self.refresher.get()()
+
+    def drain(self, timeout=REFRESH_GRACE):
+        """ wait up to timeout seconds for the refreshes under way """
+        with self.lock:
+            self.refreshed.wait_for(lambda: not self.refreshing, timeout)
+
+    def query(self, ref_id, deadline=None, fresh=False):
+        info = self._lookup('info', ref_id, lambda key, budget:
+                            q.query(key, deadline=budget), deadline, fresh)
+        return q.AttrDict(info)
+
+    def citation_counts(self, ref_id):
+        return self._lookup('count', ref_id,
+                            lambda key, budget: q.citation_counts(key))
+
+    def bib(self, ref_id, style='bibtex'):
+        import documents
+        return documents.make_bib_entry(self.query(ref_id), style)
+
+
+class Direct:
+    """ uncached lookups, straight through query.query, with the Resolver
+    interface
+    """
+    def query(self, ref_id, deadline=None, fresh=False):
+        return q.query(ref_id, deadline=deadline)
+
+    def citation_counts(self, ref_id):
+        return q.citation_counts(ref_id)
+
+    def bib(self, ref_id, style='bibtex'):
+        import documents
+        return documents.make_bib_entry(self.query(ref_id), style)
+
+
+#-----------------------------------------------------------------------------#
+#                                   Server                                    #
+#-----------------------------------------------------------------------------#
+class Handler(BaseHTTPRequestHandler):
+    resolver = None  # set by serve
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        ref_id = params.get('id', '').strip()
+        if url.path not in ('/query', '/count', '/bib') or not ref_id:
+            return self.reply(400, error='expected /query, /count or /bib '
+                                         'with an id parameter')
+        try:
+            deadline = float(params['deadline']) if params.get('deadline') else None
+        except ValueError:
+            return self.reply(400, error='deadline must be a number of seconds')
+        try:
+            if url.path == '/query':
+                self.reply(200, **self.resolver.query(
+                    ref_id, deadline, params.get('fresh') == '1'))
+            elif url.path == '/count':
+                self.reply(200, **self.resolver.citation_counts(ref_id))
+            else:
+                text = self.resolver.bib(ref_id, params.get('style', 'bibtex'))
+                self.send(200, text.encode(), 'text/plain; charset=utf-8')
+        except DeadlineExceeded as e:
+            self.reply(504, error=str(e))
+        except Exception as e:
+            cause = e.__cause__ or e
+            if q.is_not_found(e) or q.is_not_found(cause):
+                status = 404
+            elif isinstance(cause, (requests.RequestException, ValueError)):
+                status = 502 # upstream failed, or answered with an error
+            else:
+                status = 500
+            self.reply(status, error=str(e).strip())
+
+    def reply(self, status, **body):
+        self.send(status, json.dumps(body).encode(), 'application/json')
+
+    def send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        print(f"  {self.address_string()} {fmt % args}")
+
+
+class Server(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def serve(host=HOST, port=PORT, resolver=None):
+    """ serve lookups until interrupted """
+    Handler.resolver = resolver or Resolver(serve_stale=True)
+    with Server((host, port), Handler) as server:
+        print(f"  serving on http://{host}:{port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+#-----------------------------------------------------------------------------#
+#                                   Client                                    #
+#-----------------------------------------------------------------------------#
+class Client:
+    """ lookups through a running service, with the Resolver interface """
+    def __init__(self, url=f"http://{HOST}:{PORT}"):
+        self.url = url.rstrip('/')
+
+    def _get(self, path, timeout=None, **params):
+        response = requests.get(f"{self.url}{path}", params=params,
+                                timeout=timeout)
+        if response.status_code != 200:
+            error = response.json().get('error', response.reason)
+            if response.status_code == 504:
+                raise DeadlineExceeded(error)
+            if response.status_code == 404:
+                raise q.NotFound(error)
+            raise Exception(error)
+        return response
+
+    def query(self, ref_id, deadline=None, fresh=False):
+        params, timeout = dict(id=ref_id), None
+        if fresh:
+            params['fresh'] = '1'
+        deadline = Deadline.of(deadline)
+        if deadline.expires is not None:
+            params['deadline'] = timeout = deadline.remaining()
+            timeout += 5 # the service's own reply may take a moment
+        return q.AttrDict(self._get('/query', timeout, **params).json())
+
+    def citation_counts(self, ref_id):
+        return self._get('/count', id=ref_id).json()
+
+    def bib(self, ref_id, style='bibtex'):
+        return self._get('/bib', id=ref_id, style=style).text
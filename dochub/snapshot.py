@@ -0,0 +1,200 @@
+"""
+Offline arXiv metadata, from a local copy of the arXiv metadata snapshot.
+
+arXiv publishes its full metadata as a JSON-lines file (~2M records of id,
+title, authors, abstract, doi, versions, ...). `ingest` streams it once into
+a small index next to the other caches; records are then read straight from
+the snapshot file, so nothing is copied:
+
+    .cache/arxiv/
+      ids.npy        sorted arXiv ids (fixed-width bytes)
+      offsets.npy    uint64 byte offset of each id's record in the snapshot
+      lengths.npy    uint32 byte length of each record
+      doi_hash.npy   sorted uint64 hashes of (lowercased) DOIs
+      doi_row.npy    uint32 row in ids.npy for each DOI hash
+      meta.json      snapshot path, size and record count
+
+The arrays are memory-mapped and searched by bisection, so a lookup is a
+couple of page reads and one pread of the record: microseconds, no network.
+If the snapshot file is moved or changed, the index is ignored until it is
+ingested again.
+"""
+import os
+import json
+import time
+import hashlib
+from email.utils import parsedate_to_datetime
+
+import numpy as np
+
+from routing import CACHE_DIR
+
+
+INDEX_DIR = f"{CACHE_DIR}/arxiv"
+
+
+def doi_hash(doi):
+    digest = hashlib.blake2b(doi.strip().lower().encode(), digest_size=8)
+    return int.from_bytes(digest.digest(), 'little')
+
+
+def ingest(path, index_dir=INDEX_DIR, progress_every=250_000):
+    """ build the index for the snapshot at path
+
+    Returns
+    -------
+    count : int
+        number of records indexed
+    """
+    path = os.path.abspath(path)
+    ids, offsets, lengths = [], [], []
+    doi_hashes, doi_rows = [], []
+    offset = 0
+    with open(path, 'rb') as file:
+        for line in file:
+            if line.strip():
+                record = json.loads(line)
+                if record.get('doi'):
+                    # some records list several DOIs; index each of them
+                    for doi in record['doi'].split():
+                        doi_hashes.append(doi_hash(doi))
+                        doi_rows.append(len(ids))
+                ids.append(record['id'].encode())
+                offsets.append(offset)
+                lengths.append(len(line))
+                if progress_every and len(ids) % progress_every == 0:
+                    print(f"  {len(ids):>9} records")
+            offset += len(line)
+
+    #==== sort by id / hash for bisection
+    ids = np.array(ids)
+    order = np.argsort(ids, kind='stable')
+    rank  = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    doi_hashes = np.array(doi_hashes, dtype=np.uint64)
+    doi_rows   = rank[np.array(doi_rows, dtype=np.int64)].astype(np.uint32)
+    doi_order  = np.argsort(doi_hashes, kind='stable')
+
+    os.makedirs(index_dir, exist_ok=True)
+    save = lambda name, arr: np.save(os.path.join(index_dir, name), arr)
+    save('ids.npy', ids[order])
+    save('offsets.npy', np.array(offsets, dtype=np.uint64)[order])
+    save('lengths.npy', np.array(lengths, dtype=np.uint32)[order])
+    save('doi_hash.npy', doi_hashes[doi_order])
+    save('doi_row.npy', doi_rows[doi_order])
+    stat = os.stat(path)
+    meta = dict(path=path, size=stat.st_size, mtime=stat.st_mtime,
+                count=len(ids), ingested=time.time())
+    with open(os.path.join(index_dir, 'meta.json'), 'w') as file:
+        json.dump(meta, file)
+    global _snapshot, _checked
+    _snapshot, _checked = None, False # reopen with the new index
+    return len(ids)
+
+
+class Snapshot:
+    """ read-only lookups into an ingested snapshot (thread-safe) """
+    def __init__(self, index_dir=INDEX_DIR):
+        load = lambda name: np.load(os.path.join(index_dir, name), mmap_mode='r')
+        with open(os.path.join(index_dir, 'meta.json')) as file:
+            self.meta = json.load(file)
+        self.ids      = load('ids.npy')
+        self.offsets  = load('offsets.npy')
+        self.lengths  = load('lengths.npy')
+        self.doi_hash = load('doi_hash.npy')
+        self.doi_row  = load('doi_row.npy')
+        self.fd = os.open(self.meta['path'], os.O_RDONLY)
+
+    @classmethod
+    def open(cls, index_dir=INDEX_DIR):
+        """ Snapshot, or None if there is no (up to date) index """
+        try:
+            with open(os.path.join(index_dir, 'meta.json')) as file:
+                meta = json.load(file)
+            stat = os.stat(meta['path'])
+        except (OSError, ValueError):
+            return None
+        if stat.st_size != meta['size'] or stat.st_mtime != meta['mtime']:
+            return None
+        return cls(index_dir)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _row(self, arx_id):
+        key = arx_id.encode()
+        row = int(np.searchsorted(self.ids, key))
+        if row < len(self.ids) and self.ids[row] == key:
+            return row
+        return None
+
+    def _read(self, row):
+        data = os.pread(self.fd, int(self.lengths[row]), int(self.offsets[row]))
+        return json.loads(data)
+
+    def record(self, arx_id):
+        """ raw snapshot record for an arXiv id (None if not in snapshot) """
+        row = self._row(arx_id)
+        return None if row is None else self._read(row)
+
+    def arxiv_id(self, doi):
+        """ arXiv id of the preprint of a DOI (None if it has none) """
+        h = np.uint64(doi_hash(doi))
+        row = int(np.searchsorted(self.doi_hash, h))
+        while row < len(self.doi_hash) and self.doi_hash[row] == h:
+            record = self._read(int(self.doi_row[row]))
+            dois = (record.get('doi') or '').lower().split()
+            if doi.strip().lower() in dois:
+                return record['id']
+            row += 1
+        return None
+
+
+def as_feed_entry(record):
+    """ snapshot record in the shape of an arXiv API (feedparser) entry,
+    as taken by query.process_arxiv
+    """
+    stamp = lambda v: parsedate_to_datetime(v['created']).strftime(
+                          '%Y-%m-%dT%H:%M:%SZ')
+    versions = record.get('versions') or []
+    published = updated = ''
+    if versions:
+        published, updated = stamp(versions[0]), stamp(versions[-1])
+    elif record.get('update_date'):
+        published = updated = f"{record['update_date']}T00:00:00Z"
+    version = versions[-1]['version'] if versions else ''
+    authors = [' '.join(p for p in (first, last, suffix) if p)
+               for last, first, suffix, *_ in record.get('authors_parsed', [])]
+    return dict(
+        id = f"http://arxiv.org/abs/{record['id']}{version}",
+        title   = ' '.join(record.get('title', '').split()),
+        summary = record.get('abstract', '').strip(),
+        published = published,
+        updated   = updated,
+        authors = [dict(name=name) for name in authors],
+        arxiv_doi = record.get('doi'),
+        )
+
+
+#-----------------------------------------------------------------------------#
+_snapshot = None
+_checked  = False
+
+def get():
+    """ the ingested Snapshot, or None if there is none """
+    global _snapshot, _checked
+    if _snapshot is None and not _checked:
+        _snapshot = Snapshot.open()
+        _checked = True
+    return _snapshot
+
+def lookup(arx_id):
+    """ arXiv API-style entry for arx_id from the snapshot, or None """
+    snap = get()
+    record = snap.record(arx_id) if snap is not None else None
+    return None if record is None else as_feed_entry(record)
+
+def arxiv_twin(doi):
+    """ arXiv id for a DOI, from the snapshot, or None """
+    snap = get()
+    return snap.arxiv_id(doi) if snap is not None else None
@@ -0,0 +1,111 @@
+"""
+Incremental citation sync: find the papers newly citing library papers.
+
+Re-querying a paper with query_ss downloads every citation (and every
+reference) in full, every time. Instead, the citing papers already known
+for each paper are kept in the local citation graph (see graph.py), and a
+sync:
+
+  1. asks the SS graph API for the paper's current citation count only
+     (a few bytes); if it has not grown, nothing else is fetched
+  2. otherwise pages through the citations with only paperId, title and
+     year, stopping once as many unknown citing papers as the count grew
+     by have turned up
+  3. appends only those new citations to the graph, and reports them
+
+Per-paper sync state (last count, time, latest citing year) is kept in
+sync.json in the graph directory.
+"""
+import os
+import json
+import time
+
+from query import query_ss_citation_count, query_ss_citations
+
+
+PAGE_SIZE = 1000 # max the API allows
+
+
+class CitationSync:
+    """ incremental citation sync into a CitationGraph
+
+    Params
+    ------
+    graph : graph.CitationGraph
+
+    limiter : timing.RateLimiter | None
+        acquired before each request
+    """
+    def __init__(self, graph, limiter=None):
+        self.graph = graph
+        self.limiter = limiter
+        self.path  = os.path.join(graph.path, 'sync.json')
+        self.state = {}
+        if os.path.exists(self.path):
+            with open(self.path) as file:
+                self.state = json.load(file)
+        self.requests = 0
+
+    def save(self):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w') as file:
+            json.dump(self.state, file)
+        os.replace(tmp, self.path)
+
+    def _request(self, func, *args, **kwargs):
+        if self.limiter is not None:
+            self.limiter.acquire()
+        self.requests += 1
+        return func(*args, **kwargs)
+
+    def known_citing(self, node):
+        return {self.graph.keys[n] for n in self.graph.citations(node)}
+
+    def sync(self, ref_id):
+        """ sync citations of one paper
+
+        Returns
+        -------
+        new : list(dict)
+            newly found citing papers (paperId, title, year)
+        """
+        paper_id, count = self._request(query_ss_citation_count, ref_id)
+        node  = self.graph.intern(dict(paperId=paper_id))
+        known = self.known_citing(node)
+        state = self.state.setdefault(paper_id, {})
+        expected = count - len(known)
+        new = []
+        offset = 0
+        while expected > len(new) and offset is not None:
+            citing, offset = self._request(query_ss_citations, paper_id,
+                                           offset, PAGE_SIZE)
+            for paper in citing:
+                if paper.get('paperId') and paper['paperId'] not in known:
+                    known.add(paper['paperId'])
+                    new.append(paper)
+        if new:
+            src = [self.graph.intern(p) for p in new]
+            self.graph.add_edges(src, [node] * len(src))
+        years = [p['year'] for p in new if p.get('year')]
+        state.update(count=count, synced=time.time(),
+                     latest_year=max(years + [state.get('latest_year', 0)]))
+        return new
+
+    def sync_all(self, ref_ids):
+        """ sync each paper, saving graph and state as it goes
+
+        Returns
+        -------
+        new : dict
+            ref_id : newly citing papers
+        """
+        results = {}
+        for ref_id in ref_ids:
+            try:
+                results[ref_id] = self.sync(ref_id)
+            except Exception as e:
+                print(f"  ERROR syncing {ref_id}: {type(e).__name__} {e}")
+                continue
+            self.graph.flush()
+            self.save()
+        return results
@@ -0,0 +1,95 @@
+"""
+Time budgets for network calls.
+
+A Deadline is created once at the entry point (eg "return within 3 s") and
+passed down; each sub-call asks it for the remaining budget to use as its
+timeout, so the whole call tree finishes (or fails) on time.
+
+    deadline = Deadline(3)
+    requests.get(url, timeout=deadline.timeout())
+
+A RateLimiter spaces out calls shared between threads, eg to stay under
+an API's rate limit while fetching concurrently.
+"""
+import time
+import threading
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class Deadline:
+    """ an absolute point in time by which work must finish
+
+    Params
+    ------
+    seconds : float | None
+        budget from now; None means no deadline (only the per-call
+        cap given to `timeout` applies)
+    """
+    def __init__(self, seconds=None):
+        self.seconds = seconds
+        self.expires = None if seconds is None else time.monotonic() + seconds
+
+    @classmethod
+    def of(cls, deadline):
+        """ Deadline from a Deadline, number of seconds, or None """
+        if isinstance(deadline, cls):
+            return deadline
+        return cls(deadline)
+
+    def remaining(self):
+        if self.expires is None:
+            return float('inf')
+        return max(0.0, self.expires - time.monotonic())
+
+    @property
+    def expired(self):
+        return self.remaining() <= 0
+
+    def allows(self, seconds):
+        """ whether at least `seconds` of budget are left """
+        return self.remaining() >= seconds
+
+    def check(self):
+        if self.expired:
+            raise DeadlineExceeded(f"deadline of {self.seconds}s exceeded")
+
+    def timeout(self, cap=None):
+        """ remaining budget to use as a call timeout, at most cap """
+        self.check()
+        remaining = self.remaining()
+        return remaining if cap is None else min(cap, remaining)
+
+    def __repr__(self):
+        return f"Deadline({self.seconds}, remaining={self.remaining():.2f})"
+
+
+class RateLimiter:
+    """ token bucket allowing `rate` calls per second on average,
+    with bursts of up to `burst` calls; thread-safe
+
+    Usage::
+        limiter = RateLimiter(2)
+        limiter.acquire()  # blocks until a call is allowed
+    """
+    def __init__(self, rate, burst=1):
+        self.rate  = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp  = time.monotonic()
+        self.lock   = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst,
+                                  self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
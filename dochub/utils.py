@@ -33,6 +33,13 @@ LIT_INBOX = f"{PATH_LIT}/inbox.txt"
 LIT_BIBTEX = f"{PATH_LIT}/library.bib"
 # including a yaml bib until I get bibtex parsing stuff dialed in
 LIT_BIBYML = f"{PATH_LIT}/library.yml"
+LIT_LIBRARY = f"{PATH_LIT}/library"  # library records (see library.py)
+LIT_REFSIG = f"{PATH_LIT}/references.npz" # reference-set minhash index
+LIT_GRAPH  = f"{PATH_LIT}/graph"          # local citation graph store
+LIT_SEARCH = f"{PATH_LIT}/search.pkl"     # full-text search index
+LIT_FACETS = f"{PATH_LIT}/facets.npz"     # year/venue/topic/author index
+LIT_VERSIONS = f"{PATH_LIT}/versions.json" # versions of downloaded arXiv pdfs
+LIT_MIRRORS = f"{PATH_LIT}/mirrors.json"   # pdf sources (see mirrors.py)
 DOC_LOG = f"{_DOCHUB_PATH}/doc.log" # record of use
 
 
@@ -0,0 +1,50 @@
+"""
+Versions of downloaded arXiv papers.
+
+For each downloaded arXiv pdf, the version and `updated` timestamp it was
+downloaded at are kept, with the file path and the server's validators
+(ETag, Last-Modified), so `dochub.py check-updates` can tell which stored
+pdfs are stale from one batched arXiv API query, and re-download only
+those (conditionally).
+
+    versions.json
+      {arxiv id: {version, updated, path, validators}}
+"""
+import os
+import json
+import time
+
+
+class VersionStore:
+    def __init__(self, path):
+        self.path = path
+        self.papers = {}
+        if os.path.exists(path):
+            with open(path) as file:
+                self.papers = json.load(file)
+
+    def __contains__(self, arx_id):
+        return arx_id in self.papers
+
+    def get(self, arx_id):
+        return self.papers.get(arx_id)
+
+    def is_current(self, arx_id, version):
+        """ whether the stored pdf for arx_id is at least `version` """
+        paper = self.papers.get(arx_id)
+        return paper is not None and os.path.exists(paper['path']) \
+               and version is not None and paper['version'] >= version
+
+    def record(self, arx_id, version, updated, path, validators=None):
+        paper = self.papers.setdefault(arx_id, {})
+        paper.update(version=version, updated=updated,
+                     path=os.path.abspath(path), checked=time.time())
+        if validators:
+            paper['validators'] = validators
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w') as file:
+            json.dump(self.papers, file, indent=1)
+        os.replace(tmp, self.path)
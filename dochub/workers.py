@@ -0,0 +1,80 @@
+"""
+Process-pool execution of the CPU-bound stages of batch and import runs.
+
+Once fetching is concurrent, what's left of a large run is pure Python:
+unidecode/.title() on author names and slugify in processing, pybtex in
+bib rendering, and YAML (de)serialization. These hold the GIL, so they
+are handed to a ProcessPoolExecutor instead, in chunks of CHUNK records
+to amortize the pickling, while network I/O stays on threads.
+
+Workers take and return plain dicts and strings (query.AttrDict cannot
+be pickled). Small inputs, or jobs=1, run in-process.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+CHUNK = 256  # records per task
+
+
+def process_map(func, items, jobs=None, chunk=CHUNK):
+    """ [func(c) for c in chunks of items], concatenated, computed in a
+    pool of `jobs` processes (default: one per core)
+
+    func takes a list of items and returns a list of results.
+    """
+    items = list(items)
+    jobs = jobs or os.cpu_count() or 1
+    chunks = [items[i:i + chunk] for i in range(0, len(items), chunk)]
+    if jobs == 1 or len(chunks) < 2:
+        return [result for c in chunks for result in func(c)]
+    with ProcessPoolExecutor(min(jobs, len(chunks))) as pool:
+        return [result for results in pool.map(func, chunks)
+                for result in results]
+
+
+#-----------------------------------------------------------------------------#
+#                                    Tasks                                    #
+#-----------------------------------------------------------------------------#
+def process_crossref(responses):
+    """ processed info (see query.process_crossref) for crossref
+    responses; None for those lacking an author or year
+    """
+    import query as q
+    infos = []
+    for response in responses:
+        info = q.process_crossref(response)
+        try:
+            info.identifier = q.format_identifier(info)
+            info.filename   = q.format_filename(info)
+        except (KeyError, IndexError):
+            info = None # no author or year; left to query()
+        infos.append(None if info is None else dict(info))
+    return infos
+
+
+def bib_entries(records):
+    """ bibtex entries of library records """
+    import documents
+    from query import AttrDict
+    return [documents.make_bib_entry(AttrDict(r)) for r in records]
+
+
+def yaml_dump(entries):
+    """ YAML text for (identifier, fields) pairs, indented as the body of
+    an 'entries:' mapping
+    """
+    import yaml
+    text = yaml.safe_dump(dict(entries), allow_unicode=True, sort_keys=False)
+    return [''.join(f"  {line}" if line.strip() else line
+                    for line in text.splitlines(keepends=True))]
+
+
+def yaml_load(texts):
+    """ (identifier, fields) pairs of entries given as the texts of items
+    of an 'entries:' mapping (see library.split_entries)
+    """
+    import yaml
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    entries = yaml.load("entries:\n" + ''.join(texts), Loader=loader)['entries']
+    return list((entries or {}).items())